@@ -0,0 +1,196 @@
+import csv
+import itertools
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from sweep import available_cores, make_chunks, output_columns, prepare, run_chunk
+
+# adaptive sampling for sweep.py
+# instead of running every combination of parameter values, it starts from a coarse space filling design,
+# then keeps adding runs where the responses change the most between neighbouring points,
+# or where the replicates of a point disagree the most, until the run budget is used up
+#
+# config, on top of the usual sweep.py keys:
+#   [parameters]
+#   power_decline = {start = 0.1, stop = 8.0, step = 0.1}   range to sample, new points are snapped to the step,
+#                                                           or anywhere in the range if there is no step
+#   use_elevation = [true, false]                           every value is sampled separately
+#   agent_reporters = false                                 single value
+#
+#   [adaptive]
+#   budget = 240                                           total number of runs
+#   initial_points = 16                                    points in the first design, per combination of list values
+#   replicates = 2                                         runs of each new point
+#   round_size = 32                                        optional, runs per round, defaults to four per process
+#   responses = ["Average Empire Area (Hexes)", "Number of Empires"]   optional, reporters to refine on
+#   seed = 1                                               optional, seed of the initial design
+
+
+# splits the parameters into sampled ranges, lists of values and single values
+def parameter_kinds(parameters):
+    ranges = {name: value for name, value in parameters.items() if isinstance(value, dict)}
+    choices = {name: value for name, value in parameters.items() if isinstance(value, list)}
+    fixed = {name: value for name, value in parameters.items() if not isinstance(value, (dict, list))}
+    return ranges, choices, fixed
+
+
+# puts a value in [0, 1] of a range back into the range, on its step if it has one
+def scale(value, bounds):
+    start, stop = bounds["start"], bounds["stop"]
+    value = start + value * (stop - start)
+    if "step" in bounds:
+        value = start + round((value - start) / bounds["step"]) * bounds["step"]
+    return round(min(max(value, start), stop), 10)
+
+
+def unscale(value, bounds):
+    if bounds["stop"] == bounds["start"]:
+        return 0.0
+    return (value - bounds["start"]) / (bounds["stop"] - bounds["start"])
+
+
+# latin hypercube over the ranges, one design for each combination of list values
+def initial_design(ranges, choices, count, rng):
+    points = []
+    for combination in itertools.product(*choices.values()):
+        design = (rng.permuted(np.tile(np.arange(count), (len(ranges), 1)), axis=1).T + rng.random((count, len(ranges)))) / count
+        for row in design:
+            point = dict(zip(choices, combination))
+            point.update({name: scale(value, bounds) for (name, bounds), value in zip(ranges.items(), row)})
+            points.append(point)
+    return points
+
+
+class AdaptiveSweep:
+
+    def __init__(self, config):
+        self.config = config
+        self.settings = config["adaptive"]
+        self.ranges, self.choices, self.fixed = parameter_kinds(config["parameters"])
+        self.responses = self.settings.get("responses", ["Average Empire Area (Hexes)", "Number of Empires"])
+        self.replicates = self.settings.get("replicates", 2)
+        self.rng = np.random.default_rng(self.settings.get("seed"))
+
+        # response values of every run of each point, keyed by the point's parameter values
+        self.results = {}
+        self.runs = 0
+
+    def key(self, point):
+        return tuple(point[name] for name in list(self.choices) + list(self.ranges))
+
+    def make_runs(self, point, count):
+        runs = []
+        done = len(self.results.get(self.key(point), []))
+        for iteration in range(done, done + count):
+            runs.append({"RunId": self.runs, "iteration": iteration, "parameters": {**self.fixed, **point}})
+            self.runs += 1
+        return runs
+
+    def add_result(self, row):
+        point = {name: row[name] for name in list(self.choices) + list(self.ranges)}
+        self.results.setdefault(self.key(point), []).append([row[name] for name in self.responses])
+
+    # mean responses of every point with results, divided by the spread of the means so the responses weigh the same
+    def summaries(self):
+        keys = list(self.results)
+        means = np.array([np.mean(self.results[key], axis=0) for key in keys])
+        spread = np.ptp(means, axis=0)
+        spread[spread == 0] = 1
+        errors = np.array([np.std(self.results[key], axis=0, ddof=1) / np.sqrt(len(self.results[key]))
+                           if len(self.results[key]) > 1 else np.zeros(len(self.responses)) for key in keys])
+        return keys, means / spread, errors / spread
+
+    # candidate runs with a score each, the midpoints between neighbouring points and another replicate of each point
+    def candidates(self):
+        keys, means, errors = self.summaries()
+        choice_count = len(self.choices)
+        candidates = []
+
+        for index, key in enumerate(keys):
+            if len(self.results[key]) > 1:
+                point = dict(zip(list(self.choices) + list(self.ranges), key))
+                candidates.append((float(errors[index].sum()), point, 1))
+
+        # neighbours are the nearest points with the same list values, in the range scaled to [0, 1]
+        for combination in set(key[:choice_count] for key in keys):
+            members = [index for index, key in enumerate(keys) if key[:choice_count] == combination]
+            positions = np.array([[unscale(value, bounds) for value, bounds in zip(keys[index][choice_count:], self.ranges.values())]
+                                  for index in members])
+            neighbours = min(2 * len(self.ranges), len(members) - 1)
+            pairs = set()
+            for i in range(len(members)):
+                distances = np.linalg.norm(positions - positions[i], axis=1)
+                for j in np.argsort(distances)[1:neighbours + 1]:
+                    pairs.add((min(i, int(j)), max(i, int(j))))
+
+            for i, j in pairs:
+                midpoint = dict(zip(self.choices, combination))
+                midpoint.update({name: scale(value, bounds)
+                                 for (name, bounds), value in zip(self.ranges.items(), (positions[i] + positions[j]) / 2)})
+                if self.key(midpoint) in self.results:
+                    continue
+                score = float(np.abs(means[members[i]] - means[members[j]]).sum())
+                candidates.append((score, midpoint, self.replicates))
+
+        return sorted(candidates, key=lambda candidate: candidate[0], reverse=True)
+
+    # the runs of the next round, the highest scoring candidates that fit in it
+    def next_round(self, size):
+        runs = []
+        planned = set()
+        for score, point, count in self.candidates():
+            if len(runs) + count > size:
+                continue
+            key = self.key(point)
+            if key in planned:
+                continue
+            planned.add(key)
+            runs += self.make_runs(point, count)
+        return runs
+
+
+def run_adaptive_sweep(config):
+    max_steps = config.get("max_steps", 400)
+    sweep = AdaptiveSweep(config)
+    budget = sweep.settings["budget"]
+    processes = config.get("processes", available_cores())
+    round_size = sweep.settings.get("round_size", processes * 4)
+    warmup = prepare(config)
+
+    output = config["output"]
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+
+    # points that land on the same step of every range are only run once
+    design = initial_design(sweep.ranges, sweep.choices, sweep.settings.get("initial_points", 16), sweep.rng)
+    runs = []
+    for point in {sweep.key(point): point for point in design}.values():
+        runs += sweep.make_runs(point, sweep.replicates)
+    runs = runs[:budget]
+
+    start = time.time()
+    finished = 0
+    with open(output, "w", newline="") as file, multiprocessing.Pool(processes) as pool:
+        writer = None
+
+        while runs:
+            chunks = make_chunks(runs, min(processes, len(runs)))
+            tasks = [(chunk, max_steps, config.get("partitions"), config.get("agents"), warmup, config.get("recordings"),
+                      config.get("maps")) for chunk in chunks]
+            for rows in pool.imap_unordered(run_chunk, tasks):
+                if writer is None:
+                    writer = csv.DictWriter(file, fieldnames=output_columns(config, rows[0]), extrasaction="ignore")
+                    writer.writeheader()
+
+                writer.writerows(rows)
+                file.flush()
+                for row in rows:
+                    sweep.add_result(row)
+
+                finished += len(rows)
+                print(f"{finished}/{budget} runs finished ({time.time() - start:.0f}s)", flush=True)
+
+            # the next round is planned from every result so far
+            runs = sweep.next_round(min(round_size, budget - finished))
@@ -0,0 +1,113 @@
+import hashlib
+import os
+
+import numpy as np
+
+# bump this whenever the way neighbors or coastal cells are derived changes
+# so that stale cache files are not picked up
+ADJACENCY_VERSION = 1
+
+
+# compact neighbor index for the hex map
+# stored CSR style: the neighbors of cell i are neighbors[offsets[i]:offsets[i + 1]]
+class Adjacency:
+
+    def __init__(self, offsets, neighbors, coastal):
+        self.offsets = offsets
+        self.neighbors = neighbors
+        self.coastal = coastal
+        self.size = len(offsets) - 1
+
+    # indices of the neighbors of cell i, in the same order the geo space returned them
+    def neighbors_of(self, i):
+        return self.neighbors[self.offsets[i]:self.offsets[i + 1]]
+
+    # number of neighbors of every cell
+    def degrees(self):
+        return np.diff(self.offsets)
+
+
+# hashes the contents of the map file so the cache is rebuilt whenever the map changes
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+
+# works out which cells are coastal from the adjacency and the cell coordinates
+# edge marks the cells on the outside rows and columns of the grid, whose neighbors are missing because the map ends there
+# the GeoJSON map's points are not on a regular grid, so without it the edge is the bands it has always used
+def find_coastal(offsets, neighbors, x, y, edge=None):
+    if edge is None:
+        edge = ~(((x - 1) > -12) & ((x + 1) < 48) & ((y - 1) > 26) & ((y + 1) < 62.75))
+
+    # cells with missing neighbors that are not on the edge of the map are next to water
+    counts = np.diff(offsets)
+    coastal = (counts < 6) & ~edge
+
+    # fixes up the cells that are flagged but are not actually on the coast
+    # this has to go in cell order as it reads flags that earlier cells may have cleared
+    for i in np.flatnonzero(coastal):
+
+        # fixes the bottom left corner of morocco
+        if y[i] < 29.5 and x[i] < 10:
+            coastal[i] = False
+
+        # fixes the cells in the middle of Europe
+        if not coastal[neighbors[offsets[i]:offsets[i + 1]]].any():
+            coastal[i] = False
+
+    return coastal
+
+
+# builds the adjacency from the map file using the same queen contiguity the geo space uses
+def build_adjacency(path):
+    import geopandas as gpd
+    from libpysal import weights
+
+    gdf = gpd.read_file(path)
+    geometries = list(gdf.geometry)
+    x = np.array([point.x for point in geometries])
+    y = np.array([point.y for point in geometries])
+
+    queen = weights.contiguity.Queen.from_iterable(geometries)
+
+    offsets = [0]
+    neighbors = []
+    for i, key in enumerate(queen.neighbors.keys()):
+
+        # cells that are separated by bodies of water are still technically touching,
+        # as there are no cells within the body of water, so only close cells are kept
+        for j in queen.neighbors[key]:
+            if geometries[i].distance(geometries[j]) < 1:
+                neighbors.append(j)
+        offsets.append(len(neighbors))
+
+    offsets = np.array(offsets, dtype=np.int32)
+    neighbors = np.array(neighbors, dtype=np.int32)
+
+    return Adjacency(offsets, neighbors, find_coastal(offsets, neighbors, x, y))
+
+
+# loads the adjacency for a map file, building and caching it on the first use
+def load_adjacency(path, cache_dir="gis_data/cache"):
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    cache_path = os.path.join(cache_dir, f"{name}_adjacency_v{ADJACENCY_VERSION}_{file_hash(path)}.npz")
+
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as data:
+            return Adjacency(data["offsets"], data["neighbors"], data["coastal"])
+
+    adjacency = build_adjacency(path)
+
+    # writes to a temporary file first so that batch workers racing to build the cache
+    # never read a half written file
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = f"{cache_path}.{os.getpid()}.tmp.npz"
+    np.savez(temp_path, offsets=adjacency.offsets, neighbors=adjacency.neighbors, coastal=adjacency.coastal)
+    os.replace(temp_path, cache_path)
+
+    return adjacency
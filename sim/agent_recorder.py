@@ -0,0 +1,107 @@
+import json
+import os
+
+import numpy as np
+
+# per step cell columns and the type each is stored as
+dynamic_columns = {"owner": np.int32,
+                   "times_changed_hands": np.int32,
+                   "asabiya": np.float64}
+
+
+# records the state of every cell each step as fixed type numpy blocks on disk,
+# instead of a python tuple per agent per step in the data collector
+#
+# the columns that never change (coordinates, elevation, coastal) are written once as .npy files,
+# and each per step column is a raw file that every step appends one value per cell to,
+# so a whole run reads back as a (steps, cells) memory mapped array
+#
+# resume_steps carries on a run restored from a checkpoint in the directory it was recorded to,
+# keeping its first resume_steps steps and dropping any written after the checkpoint
+class AgentRecorder:
+
+    def __init__(self, directory, world, steps_per_block=50, resume_steps=None):
+        self.directory = directory
+        self.size = world.size
+        self.steps = 0
+
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "x.npy"), world.x)
+        np.save(os.path.join(directory, "y.npy"), world.y)
+        np.save(os.path.join(directory, "elevation.npy"), world.elevation)
+        np.save(os.path.join(directory, "coastal.npy"), world.coastal)
+
+        with open(os.path.join(directory, "agents.json"), "w") as file:
+            json.dump({"cells": self.size, "map_file": world.path,
+                       "columns": {column: np.dtype(dtype).str for column, dtype in dynamic_columns.items()}}, file)
+
+        # steps are gathered into preallocated blocks and written a block at a time
+        self.blocks = {column: np.zeros((steps_per_block, self.size), dtype=dtype) for column, dtype in dynamic_columns.items()}
+        self.buffered = 0
+
+        # starts every column file empty, in case the directory held an earlier run
+        if resume_steps is None:
+            for column in dynamic_columns:
+                open(self.column_path(column), "wb").close()
+            return
+
+        for column, dtype in dynamic_columns.items():
+            length = resume_steps * self.size * np.dtype(dtype).itemsize
+            if os.path.getsize(self.column_path(column)) < length:
+                raise ValueError(f"{directory} has fewer than the {resume_steps} steps to resume from")
+            os.truncate(self.column_path(column), length)
+        self.steps = resume_steps
+
+    def column_path(self, column):
+        return os.path.join(self.directory, f"{column}.bin")
+
+    # records the current state of every cell
+    def record(self, model):
+        row = self.buffered
+        if model.engine:
+            self.blocks["owner"][row] = model.engine.owner
+            self.blocks["times_changed_hands"][row] = model.engine.times_changed_hands
+            self.blocks["asabiya"][row] = model.engine.asabiya
+        else:
+            cells = model.cells
+            self.blocks["owner"][row] = np.fromiter((cell.empire.id for cell in cells), dtype=np.int32, count=self.size)
+            self.blocks["times_changed_hands"][row] = np.fromiter((cell.times_changed_hands for cell in cells), dtype=np.int32, count=self.size)
+            self.blocks["asabiya"][row] = np.fromiter((cell.asabiya for cell in cells), dtype=np.float64, count=self.size)
+
+        self.buffered += 1
+        self.steps += 1
+        if self.buffered == len(self.blocks["owner"]):
+            self.flush()
+
+    # appends the buffered steps to the column files
+    def flush(self):
+        if self.buffered == 0:
+            return
+
+        for column, block in self.blocks.items():
+            with open(self.column_path(column), "ab") as file:
+                file.write(block[:self.buffered].tobytes())
+        self.buffered = 0
+
+    def close(self):
+        self.flush()
+
+
+# reads a recorded run back
+# static columns are (cells,) arrays and per step columns are (steps, cells) arrays,
+# all memory mapped, so whole runs can be analysed without loading them into memory
+def read_agents(directory):
+    with open(os.path.join(directory, "agents.json")) as file:
+        layout = json.load(file)
+
+    data = {}
+    for column in ("x", "y", "elevation", "coastal"):
+        data[column] = np.load(os.path.join(directory, f"{column}.npy"), mmap_mode="r")
+
+    for column, dtype in layout["columns"].items():
+        path = os.path.join(directory, f"{column}.bin")
+        if os.path.getsize(path) > 0:
+            data[column] = np.memmap(path, dtype=np.dtype(dtype), mode="r").reshape(-1, layout["cells"])
+        else:
+            data[column] = np.zeros((0, layout["cells"]), dtype=np.dtype(dtype))
+    return data
@@ -0,0 +1,256 @@
+import random
+
+import numpy as np
+
+from religion import Religion
+
+# model parameters the array engine reads
+parameter_names = ["power_decline", "delta_power", "asa_growth", "asa_decay", "elevation_constant", "use_elevation"]
+
+
+# struct of arrays version of the simulation
+# every cell is an index into the cell arrays and every empire is an index into the empire arrays,
+# empire 0 being the default empire that holds the independent chiefdoms
+#
+# cells are updated all at once each step from the state at the start of the step,
+# instead of one at a time in a random order like the EmpireCell agents are,
+# and conquests are resolved afterward in a random order with each cell changing hands at most once per step
+# a chiefdom that founds an empire also leaves the default empire, and the cell it takes leaves its old empire,
+# where an EmpireCell founder stays listed in the default empire and the cell it takes in the empire it was taken from
+# so runs differ from the object engine's by design as well as by seed, with fewer and larger empires on average,
+# tests/test_array_engine.py having the measured difference
+#
+# the engine steps any number of replicates of the map together, laid end to end in the cell arrays,
+# replicate r's cell i being r * cells + i, with each replicate's edges being the map's edges shifted by the same offset
+# a model's engine is the single replicate case, and ensemble.py steps many at once
+# empire ids are shared between the replicates, each empire belonging to the replicate it was founded in
+class ArrayEngine:
+
+    # the parameters are read from the model, or given as a dict of a value or one value per replicate
+    # elevation_constant is the one the model uses internally, 10 - the constructor argument
+    def __init__(self, model, world, replicates=1, parameters=None):
+
+        self.model = model
+        self.world = world
+        self.replicates = replicates
+        n = world.size
+
+        # separate generator for the per step draws, seeded from the global one so seeded runs repeat
+        self.rng = np.random.default_rng(random.getrandbits(64))
+
+        # parameters of every replicate, and spread out to the cells
+        if parameters is None:
+            parameters = {name: getattr(model, name) for name in parameter_names}
+        self.power_decline = self.per_replicate(parameters["power_decline"])
+        self.delta_power = self.per_replicate(parameters["delta_power"])
+        self.asa_growth = self.per_replicate(parameters["asa_growth"])
+        self.asa_decay = self.per_replicate(parameters["asa_decay"])
+        self.elevation_constant = self.per_replicate(parameters["elevation_constant"])
+        self.use_elevation = self.per_replicate(parameters["use_elevation"], dtype=bool)
+
+        self.replicate = np.repeat(np.arange(replicates), n)
+        self.cell_power_decline = self.power_decline[self.replicate]
+        self.cell_delta_power = self.delta_power[self.replicate]
+        self.cell_asa_growth = self.asa_growth[self.replicate]
+        self.cell_asa_decay = self.asa_decay[self.replicate]
+
+        self.x = np.tile(world.x, replicates)
+        self.y = np.tile(world.y, replicates)
+
+        # directed edges in adjacency order, so the edges of each cell are contiguous
+        offsets = np.arange(replicates)[:, None] * n
+        self.edge_source = (world.edge_source.astype(np.intp)[None, :] + offsets).ravel()
+        self.edge_target = (world.adjacency.neighbors.astype(np.intp)[None, :] + offsets).ravel()
+        self.edge_modifier = np.concatenate([world.elevation_modifiers(float(constant), bool(use_elevation))
+                                             for constant, use_elevation in zip(self.elevation_constant, self.use_elevation)])
+
+        # cell state
+        # cells start out in the default empire, which flips their ultrasociality to -5
+        size = replicates * n
+        self.owner = np.zeros(size, dtype=np.intp)
+        self.prev_owner = np.zeros(size, dtype=np.intp)
+        self.asabiya = np.full(size, 0.001)
+        self.ultrasociality = np.full(size, -5.0)
+        self.power = np.zeros(size)
+        self.fortification = np.ones(size)
+        self.times_changed_hands = np.zeros(size, dtype=np.int64)
+
+        # empire state, indexed by empire id
+        # grown as new empires are founded
+        self.empire_count = 1
+        self.attack_chance = np.zeros(64)
+        self.attack_chance[0] = model.default_religion.attack_chance if model is not None else 0
+        self.empire_replicate = np.zeros(64, dtype=np.intp)
+        self.empire_size = np.zeros(1, dtype=np.int64)
+        self.center_x = np.zeros(1)
+        self.center_y = np.zeros(1)
+        self.average_asabiya = np.zeros(1)
+        self.average_us = np.zeros(1)
+
+        # data variables of every replicate
+        self.avg_empire_area = np.zeros(replicates)
+        self.empire_counts = np.zeros(replicates, dtype=np.int64)
+        self.area_histogram = np.zeros((replicates, 13), dtype=np.int64)
+
+        # sets up each replicate's initial empire from a random cell and its neighbors
+        self.starting_x = np.zeros(replicates)
+        self.starting_y = np.zeros(replicates)
+        for r in range(replicates):
+            start = random.randint(0, n - 1)
+            self.starting_x[r] = world.x[start]
+            self.starting_y[r] = world.y[start]
+            starting_cells = r * n + np.concatenate(([start], world.adjacency.neighbors_of(start))).astype(np.intp)
+            self.change_hands(starting_cells, np.full(len(starting_cells), self.new_empires(np.array([r]))[0]))
+
+    def per_replicate(self, value, dtype=np.float64):
+        return np.broadcast_to(np.asarray(value, dtype=dtype), (self.replicates,)).copy()
+
+    # founds a new empire, each with a new religion, in each of the given replicates and returns their ids
+    def new_empires(self, replicates):
+
+        k = len(replicates)
+        ids = np.arange(self.empire_count, self.empire_count + k)
+        self.empire_count += k
+
+        if self.empire_count > len(self.attack_chance):
+            capacity = max(2 * len(self.attack_chance), self.empire_count)
+            self.attack_chance = np.resize(self.attack_chance, capacity)
+            self.empire_replicate = np.resize(self.empire_replicate, capacity)
+
+        self.empire_replicate[ids] = replicates
+        for empire_id in ids:
+            self.attack_chance[empire_id] = Religion(empire_id).attack_chance
+
+        return ids
+
+    # moves cells into new empires, like Empire.add_cell does for a single cell
+    def change_hands(self, cells, new_owner):
+
+        self.times_changed_hands[cells] += 1
+
+        # loses ultrasociality unless the cell is going back to the empire it was in before
+        flip = (self.ultrasociality[cells] > 0) | (self.prev_owner[cells] == new_owner)
+        self.ultrasociality[cells] = np.where(flip, -self.ultrasociality[cells], 0)
+
+        self.prev_owner[cells] = self.owner[cells]
+        self.owner[cells] = new_owner
+
+    # recalculates the size, center and averages of every empire from the cell arrays,
+    # and each replicate's area histogram, number of empires and average area from its empires
+    # a model's engine also updates the model's histogram and average area
+    def update_empires(self):
+
+        owner = self.owner
+        size = np.bincount(owner, minlength=self.empire_count)
+        occupied = np.maximum(size, 1)
+
+        self.empire_size = size
+        self.center_x = np.round(np.bincount(owner, weights=self.x, minlength=self.empire_count) / occupied)
+        self.center_y = np.round(np.bincount(owner, weights=self.y, minlength=self.empire_count) / occupied)
+        self.average_asabiya = np.bincount(owner, weights=self.asabiya, minlength=self.empire_count) / occupied
+        self.average_us = np.bincount(owner, weights=self.ultrasociality, minlength=self.empire_count) / occupied
+
+        # only empires with size greater than 5 are counted, same as in the object model
+        ids = np.flatnonzero(size[1:] > 5) + 1
+        counted = size[ids]
+        replicate = self.empire_replicate[ids]
+        bins = np.where(counted > 600, 12, counted // 50)
+        self.area_histogram = np.bincount(replicate * 13 + bins, minlength=self.replicates * 13).reshape(self.replicates, 13)
+
+        # replicates with no counted empires keep their last average, as the model does
+        self.empire_counts = np.bincount(replicate, minlength=self.replicates)
+        total = np.bincount(replicate, weights=counted, minlength=self.replicates)
+        has_empires = self.empire_counts > 0
+        self.avg_empire_area[has_empires] = total[has_empires] / self.empire_counts[has_empires]
+
+        if self.model is not None:
+            self.model.area_histogram[:] = self.area_histogram[0].tolist()
+            if has_empires[0]:
+                self.model.avg_empire_area = float(self.avg_empire_area[0])
+
+    # number of empires with size greater than 5, over every replicate
+    def number_of_empires(self):
+        return int(np.count_nonzero(self.empire_size[1:] > 5))
+
+    # steps every cell at once
+    def step(self):
+
+        owner = self.owner
+        source = self.edge_source
+        target = self.edge_target
+        n = len(owner)
+
+        # counts the enemy neighbors of every cell
+        enemy_edge = owner[source] != owner[target]
+        enemy_count = np.bincount(source[enemy_edge], minlength=n)
+        in_empire = owner != 0
+
+        # ultrasociality recovers back up to 5
+        np.minimum(self.ultrasociality + 0.25, 5, out=self.ultrasociality)
+
+        # asabiya grows on the border and decays in the interior
+        # chiefdoms always count as border cells
+        border = (enemy_count > 0) | ~in_empire
+        self.asabiya = np.where(border,
+                                self.asabiya + self.cell_asa_growth * self.asabiya * (1 - self.asabiya),
+                                self.asabiya - self.cell_asa_decay * self.asabiya)
+
+        # sets power according to the Turchin equation
+        # power = empire size * average empire asabiya * e^(-1 * distance to empire's center / power decline)
+        size = self.empire_size[owner]
+        distance = np.where(size > 1, np.hypot(self.center_x[owner] - self.x, self.center_y[owner] - self.y), 0)
+        self.power = np.where(in_empire,
+                              size * (5 + self.ultrasociality) * self.average_asabiya[owner] * np.exp(-1 * distance / self.cell_power_decline),
+                              self.asabiya * (5 - self.ultrasociality))
+
+        # empire cells attack according to their empire's attack chance, chiefdoms always attack
+        # cells that hold off build up their fortification instead
+        has_enemy = enemy_count > 0
+        attacks = has_enemy & (~in_empire | (self.rng.random(n) < self.attack_chance[owner]))
+        fortify = has_enemy & in_empire & ~attacks & (self.fortification < 2)
+        self.fortification[fortify] += 0.2
+        self.fortification[attacks & in_empire] = 1
+
+        attackers = np.flatnonzero(attacks)
+        if len(attackers) == 0:
+            return
+
+        # each attacker picks one of its enemy neighbors at random
+        # enemy edges are grouped by cell, so the k-th enemy edge of a cell is found from the running count
+        enemy_edges = np.flatnonzero(enemy_edge)
+        first_enemy_edge = np.cumsum(enemy_count) - enemy_count
+        pick = (self.rng.random(len(attackers)) * enemy_count[attackers]).astype(np.intp)
+        edges = enemy_edges[first_enemy_edge[attackers] + pick]
+        targets = target[edges]
+
+        # determines whether the difference in power between the cells is greater than the delta_power value
+        difference = self.power[attackers] - (self.power[targets] * self.edge_modifier[edges] * self.fortification[targets])
+        won = difference > self.cell_delta_power[attackers]
+        if self.model is not None and self.model.battle_log is not None:
+            self.model.battle_log.record_many(self.model.steps, attackers, targets, difference, won)
+
+        attackers = attackers[won]
+        targets = targets[won]
+        if len(attackers) == 0:
+            return
+
+        # a cell can only be taken once per step, so the winner is picked at random among the attackers
+        order = self.rng.permutation(len(attackers))
+        _, first = np.unique(targets[order], return_index=True)
+        winners = order[first]
+        attackers = attackers[winners]
+        targets = targets[winners]
+        new_owner = owner[attackers]
+
+        # the attacked cell's asabiya becomes the average of the two cells
+        self.asabiya[targets] = (self.asabiya[attackers] + self.asabiya[targets]) / 2.0
+
+        # chiefdoms that win found a new empire in their replicate with the cell they attacked
+        # unless they were taken over themselves this step
+        founders = new_owner == 0
+        if founders.any():
+            new_owner[founders] = self.new_empires(self.replicate[attackers[founders]])
+            founding = ~np.isin(attackers, targets) & founders
+            self.change_hands(attackers[founding], new_owner[founding])
+
+        self.change_hands(targets, new_owner)
@@ -0,0 +1,166 @@
+import json
+import threading
+import time
+
+from delta_map import DeltaMapModule, DeltaMapServer, DeltaSocketHandler
+from model import EuropeModel
+
+
+# steps a model on a worker thread, so the server only ever samples its latest state instead of waiting on it
+# the worker runs on its own once started, at speed steps per second or as fast as it can if speed is 0,
+# and pausing, the speed and fast forwarding can all be changed while it runs
+# the lock is held for a whole step, so the state is never read halfway through one
+class BackgroundRunner:
+
+    def __init__(self, model, paused=False, speed=0, fast_forward=0):
+        self.model = model
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+
+        self.started = False
+        self.paused = paused
+        self.speed = speed
+
+        # steps left to run straight through, without waiting to be started, unpaused or for the speed
+        self.fast_forward_steps = fast_forward
+        self.stopped = False
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.fast_forward_steps <= 0 and (not self.started or self.paused) and not self.stopped:
+                    self.condition.wait()
+                if self.stopped:
+                    break
+
+                self.model.simulate()
+                if not self.model.running:
+                    break
+
+                if self.fast_forward_steps > 0:
+                    self.fast_forward_steps -= 1
+                    delay = 0
+                else:
+                    delay = 1 / self.speed if self.speed > 0 else 0
+
+            # waits outside the lock, so frames can be taken in between steps
+            if delay > 0:
+                time.sleep(delay)
+
+        # writes out the rest of the recording if the run is being recorded
+        self.model.close()
+
+    def start(self):
+        with self.condition:
+            self.started = True
+            self.condition.notify()
+
+    def set_paused(self, paused):
+        with self.condition:
+            self.paused = paused
+            self.condition.notify()
+
+    def set_speed(self, speed):
+        with self.condition:
+            self.speed = speed
+
+    # runs steps more steps straight through
+    def fast_forward(self, steps):
+        with self.condition:
+            self.fast_forward_steps += steps
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+
+# EuropeModel for the server, stepped by a BackgroundRunner
+# the first step call from the browser starts the worker, and every step call after that returns straight away,
+# so the browser renders at its own frame rate from whatever step the worker has got to
+# paused, speed and fast_forward are the worker's starting controls, and are changed while it runs with control,
+# fast_forward steps being run as soon as they are given, e.g. to go straight to the end of run heatmap
+# if record is set, the run is recorded to output_data/recordings for playback.py, written as the run goes
+class BackgroundEuropeModel(EuropeModel):
+
+    # model of the current run, stopped when the server builds a new one
+    current = None
+
+    # parameters that change the running worker instead of waiting for the next reset
+    controls = ["paused", "speed", "fast_forward"]
+
+    def __init__(self, paused=False, speed=0, fast_forward=0, record=False, **parameters):
+        if record:
+            parameters["recording"] = f"output_data/recordings/run_{time.strftime('%Y%m%d_%H%M%S')}"
+        super().__init__(**parameters)
+
+        if BackgroundEuropeModel.current is not None:
+            BackgroundEuropeModel.current.runner.stop()
+        BackgroundEuropeModel.current = self
+
+        self.runner = BackgroundRunner(self, bool(paused), float(speed), int(fast_forward))
+
+    # called by the server once per frame
+    def step(self):
+        if not self.runner.started:
+            self.runner.start()
+
+    # changes one of the worker's controls
+    def control(self, name, value):
+        if name == "paused":
+            self.runner.set_paused(bool(value))
+        elif name == "speed":
+            self.runner.set_speed(float(value))
+        elif name == "fast_forward":
+            self.runner.fast_forward(int(float(value)))
+
+    # a real step of the model, run by the worker
+    def simulate(self):
+        super().step()
+
+
+# passes changes to the worker's controls on to the running model as well as keeping them for the next reset
+# the worker finishes the run on its own, so the browser has not seen the last steps, or the end of run heatmap,
+# by the time it asks for a step and is told the run has ended
+# the frame of the finished run is sent before the end message, once per model, as rendering it makes the browser ask again
+class BackgroundSocketHandler(DeltaSocketHandler):
+
+    def open(self):
+        super().open()
+        self.finished_model = None
+
+    def on_message(self, message):
+        parsed = json.loads(message)
+        model = self.application.model
+        if parsed["type"] == "get_step" and not model.running and self.finished_model is not model:
+            self.finished_model = model
+            self.write_message(self.viz_state_message)
+
+        super().on_message(message)
+
+        if parsed["type"] == "submit_params" and parsed["param"] in BackgroundEuropeModel.controls:
+            if isinstance(self.application.model, BackgroundEuropeModel):
+                self.application.model.control(parsed["param"], parsed["value"])
+
+
+# server for a background model
+# each frame snapshots the model with its lock held, so a frame is never taken halfway through a step,
+# and builds the frame from the snapshot after letting go of it, so the worker is only held up by the snapshot
+class BackgroundServer(DeltaMapServer):
+
+    socket_handler = BackgroundSocketHandler
+
+    def render_model(self, client=None):
+        runner = getattr(self.model, "runner", None)
+        if runner is None:
+            return super().render_model(client)
+
+        with runner.lock:
+            snapshots = [element.snapshot(self.model, client) if isinstance(element, DeltaMapModule) else element.render(self.model)
+                         for element in self.visualization_elements]
+        return [element.frame(snapshot, client) if isinstance(element, DeltaMapModule) else snapshot
+                for element, snapshot in zip(self.visualization_elements, snapshots)]
@@ -0,0 +1,61 @@
+import numpy as np
+
+# layout of a single recorded attack
+battle_dtype = np.dtype([("step", np.int32),
+                         ("attacker", np.int32),
+                         ("defender", np.int32),
+                         ("difference", np.float64),
+                         ("won", np.bool_)])
+
+
+# opt-in record of every attack in a run
+# attacks are written into a preallocated ring buffer, so recording never allocates
+# once the buffer is full the oldest attacks are overwritten
+class BattleLog:
+
+    def __init__(self, capacity=1 << 20):
+        self.capacity = capacity
+        self.entries = np.zeros(capacity, dtype=battle_dtype)
+
+        # total number of attacks ever recorded, including ones that have since been overwritten
+        self.count = 0
+
+    # records a single attack
+    def record(self, step, attacker, defender, difference, won):
+        self.entries[self.count % self.capacity] = (step, attacker, defender, difference, won)
+        self.count += 1
+
+    # records many attacks at once, each argument being an array with one element per attack
+    def record_many(self, step, attackers, defenders, differences, won):
+        n = len(attackers)
+        if n == 0:
+            return
+
+        # only the last capacity attacks can be kept
+        if n > self.capacity:
+            self.count += n - self.capacity
+            attackers, defenders, differences, won = (attackers[-self.capacity:], defenders[-self.capacity:],
+                                                       differences[-self.capacity:], won[-self.capacity:])
+            n = self.capacity
+
+        slots = (self.count + np.arange(n)) % self.capacity
+        self.entries["step"][slots] = step
+        self.entries["attacker"][slots] = attackers
+        self.entries["defender"][slots] = defenders
+        self.entries["difference"][slots] = differences
+        self.entries["won"][slots] = won
+        self.count += n
+
+    # attacks recorded after the log held start attacks, oldest first
+    # attacks that have already been overwritten are left out
+    def since(self, start):
+        start = max(start, self.count - self.capacity)
+        return self.entries[np.arange(start, self.count) % self.capacity]
+
+    # every attack still held, oldest first
+    def records(self):
+        return self.since(0)
+
+    # writes the held attacks to a binary .npy file
+    def save(self, path):
+        np.save(path, self.records())
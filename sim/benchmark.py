@@ -0,0 +1,171 @@
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from importlib import metadata
+
+import numpy as np
+
+# benchmarks the model on a fixed set of seeded scenarios, so timings can be compared across commits and library versions
+# usage: python benchmark.py [output.json] [scenario ...]
+#        python benchmark.py compare <before.json> <after.json>
+#
+# for every scenario it reports how long loading the map and building the model take, both cold in a fresh process
+# and warm with the map already loaded, then steps per second over the first 100, 400 and 800 steps,
+# the latency percentiles of a single step and the peak memory of the process
+# results are written as json, by default to output_data/benchmarks/<commit>.json
+# when both engine scenarios are run, the array engine's speedup over the object engine is recorded with them
+
+# steps the cumulative steps per second are reported at
+step_counts = [100, 400, 800]
+
+# EuropeModel constructor arguments of every scenario, each run with the same seed every time
+scenarios = {"object engine": {},
+             "low power decline": {"power_decline": 0.5},
+             "high power decline": {"power_decline": 8},
+             "no elevation": {"use_elevation": False},
+             "elevation": {"use_elevation": True, "elevation_constant": 8},
+             "batched religion": {"batched_religion": True},
+             "battle log": {"record_battles": True},
+             "array engine": {"array_engine": True}}
+
+seed = 1
+
+
+# runs a single scenario and returns its timings
+def run_scenario(name):
+    from model import EuropeModel
+    from world import load_world
+
+    parameters = {"agent_reporters": False, **scenarios[name], "seed": seed}
+
+    # the scenario runs in a fresh process, so the first model pays for parsing the map and building the world,
+    # which every later model in the process shares
+    start = time.perf_counter()
+    load_world()
+    world_load = time.perf_counter() - start
+    model = EuropeModel(**parameters)
+    cold_construction = time.perf_counter() - start
+
+    # the model that is stepped is built again with the world already loaded, from the same seed
+    del model
+    start = time.perf_counter()
+    model = EuropeModel(**parameters)
+    warm_construction = time.perf_counter() - start
+
+    latencies = np.zeros(step_counts[-1])
+    for step in range(step_counts[-1]):
+        start = time.perf_counter()
+        model.step()
+        latencies[step] = time.perf_counter() - start
+
+    elapsed = np.cumsum(latencies)
+    return {"parameters": parameters,
+            "world_load_seconds": world_load,
+            "cold_construction_seconds": cold_construction,
+            "warm_construction_seconds": warm_construction,
+            "steps_per_second": {str(count): count / elapsed[count - 1] for count in step_counts},
+            "step_latency_ms": {f"p{p}": float(np.percentile(latencies, p) * 1000) for p in (50, 90, 99)},
+            "step_latency_max_ms": float(latencies.max() * 1000),
+
+            # ru_maxrss is in kilobytes on linux and bytes on macos
+            "peak_memory_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1 << 20 if sys.platform == "darwin" else 1 << 10),
+
+            # end of run values, which should only change between commits if the model itself changed
+            "final": {"Average Empire Area (Hexes)": model.avg_empire_area,
+                      "Number of Empires": model.number_of_empires()}}
+
+
+def package_version(name):
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run_benchmarks(names, output=None):
+    commit = git_commit()
+    results = {"commit": commit,
+               "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+               "python": platform.python_version(),
+               "platform": platform.platform(),
+               "packages": {name: package_version(name) for name in ("mesa", "mesa-geo", "numpy", "shapely")},
+               "seed": seed,
+               "scenarios": {}}
+
+    # every scenario runs in a fresh process, so its peak memory is its own and no scenario warms up the next
+    with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+        for name in names:
+            results["scenarios"][name] = pool.apply(run_scenario, (name,))
+            scenario = results["scenarios"][name]
+            print(f"{name}: built in {scenario['cold_construction_seconds']:.2f}s cold "
+                  f"({scenario['world_load_seconds']:.2f}s of it loading the map), {scenario['warm_construction_seconds']:.2f}s warm, "
+                  f"{scenario['steps_per_second'][str(step_counts[-1])]:.1f} steps/s, "
+                  f"p99 step {scenario['step_latency_ms']['p99']:.1f}ms, "
+                  f"{scenario['peak_memory_mb']:.0f}MB", flush=True)
+
+    # steps per second of the array engine over the object engine with the same parameters and seed
+    if "object engine" in results["scenarios"] and "array engine" in results["scenarios"]:
+        results["array_engine_speedup"] = (results["scenarios"]["array engine"]["steps_per_second"][str(step_counts[-1])] /
+                                           results["scenarios"]["object engine"]["steps_per_second"][str(step_counts[-1])])
+        print(f"array engine speedup: x{results['array_engine_speedup']:.1f}")
+
+    if output is None:
+        output = os.path.join("output_data", "benchmarks", f"{commit}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"results written to {output}")
+
+
+# prints how every scenario changed between two result files, as after / before ratios
+def compare(before_path, after_path):
+    with open(before_path) as file:
+        before = json.load(file)
+    with open(after_path) as file:
+        after = json.load(file)
+
+    print(f"{before['commit']} -> {after['commit']}")
+    if "array_engine_speedup" in before and "array_engine_speedup" in after:
+        print(f"array engine speedup: x{before['array_engine_speedup']:.1f} -> x{after['array_engine_speedup']:.1f}")
+    for name, new in after["scenarios"].items():
+        if name not in before["scenarios"]:
+            continue
+        old = before["scenarios"][name]
+        speedup = new["steps_per_second"][str(step_counts[-1])] / old["steps_per_second"][str(step_counts[-1])]
+        print(f"{name}: steps/s x{speedup:.2f}, "
+              f"cold construction x{new['cold_construction_seconds'] / old['cold_construction_seconds']:.2f}, "
+              f"warm construction x{new['warm_construction_seconds'] / old['warm_construction_seconds']:.2f}, "
+              f"p99 step x{new['step_latency_ms']['p99'] / old['step_latency_ms']['p99']:.2f}, "
+              f"memory x{new['peak_memory_mb'] / old['peak_memory_mb']:.2f}")
+
+        # the same seed should give the same run, unless the model's behaviour changed
+        if new["final"] != old["final"]:
+            print(f"    final state differs: {old['final']} -> {new['final']}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "compare":
+        if len(sys.argv) != 4:
+            print("usage: python benchmark.py compare <before.json> <after.json>")
+            sys.exit(1)
+        compare(sys.argv[2], sys.argv[3])
+    else:
+        output = sys.argv[1] if len(sys.argv) > 1 else None
+        names = sys.argv[2:] or list(scenarios)
+        unknown = [name for name in names if name not in scenarios]
+        if unknown:
+            print(f"unknown scenarios: {', '.join(unknown)}, choose from: {', '.join(scenarios)}")
+            sys.exit(1)
+        run_benchmarks(names, output)
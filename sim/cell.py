@@ -23,6 +23,10 @@ class EmpireCell(mg.GeoAgent):
 
         self.elevation = None
 
+        # how much the cell's elevation damps religious conversion
+        # worked out once when the elevation is set up, see religion_elevation_modifier
+        self.elev_mod = 1
+
         # whether the cell is coastal or not
         self.coastal = False
 
@@ -47,7 +51,14 @@ class EmpireCell(mg.GeoAgent):
 
         # initializes cells as part of no empire (independent chiefdoms, stored as "default empire")
         self.empire = self.model.default_empire
-        self.prev_empire = None
+
+        # empires whose cell lists hold the cell, kept up to date by Empire.add_cell and remove_cell
+        # usually just its own empire, but a chiefdom that founds an empire stays listed in the default empire,
+        # and the cell it takes stays listed in the empire it was taken from
+        self.listed_in = []
+
+        # id of the empire the cell was in before its current one
+        self.prev_empire_id = None
 
         # initial asabiya
         self.asabiya = 0.001
@@ -57,11 +68,14 @@ class EmpireCell(mg.GeoAgent):
 
         self.ultrasociality = 5
 
-        self.majReligion = Religion(0)
-        self.majReligion.type = "non-pros"
-        self.majReligion.tolerance = 0.75
-        self.majReligion.conversion = 1
-        self.religions = [self.majReligion]
+        # religions held by the cell, as ids into the model's religion registry,
+        # with the conversion level of each in a parallel list
+        # kept sorted from most to least converted, so the majority religion is always first
+        self.religion_ids = [0]
+        self.conversions = [1]
+
+        # id of the majority religion, or None if no religion has at least half the cell converted
+        self.majReligion = 0
 
         self.id = unique_id
 
@@ -71,34 +85,12 @@ class EmpireCell(mg.GeoAgent):
         # stores the neighbors of the cell when set up
         self.neighbors = []
 
-    # sets up the neighbors for each cell
-    def setup_neighbors(self):
-
-        # gets the touching neighbors for each cell
-        neighbors = self.model.space.get_neighbors(self)
+        # number of neighbors in a different empire, kept up to date by Empire.add_cell
+        self.enemy_neighbors = 0
 
-        # checks to make sure that the cells are actually close together on the map
-        # cells that are separated by bodies of water are still technically touching,
-        # as there are no cells within the body of water
-        for neighbor in neighbors:
-            if self.model.space.distance(self, neighbor) < 1:
-                self.neighbors.append(neighbor)
-
-        if len(self.neighbors) < 6 and (self.x - 1) > -12 and (self.x + 1) < 48 and (self.y - 1) > 26 and (self.y + 1) < 62.75:
-            self.coastal = True
-
-    def fix_coastal(self):
-
-        # fixes the bottom left corner of morocco
-        if self.y < 29.5 and self.x < 10:
-            self.coastal = False
-
-        # fixes the cells in the middle of Europe
-        for neighbor in self.neighbors:
-            if neighbor.coastal:
-                return
-        else:
-            self.coastal = False
+        # elevation modifier for attacking or spreading to each neighbor, keyed by neighbor id
+        # looked up from the model's per edge table when set up
+        self.neighbor_modifiers = {}
 
     def add_technology(self, tech):
         self.technology.append(tech)
@@ -137,21 +129,7 @@ class EmpireCell(mg.GeoAgent):
             else:
                 chance = 5
 
-            if self.model.use_elevation:
-                # calculation of the attacked cell's elevation modifier
-                # easier to win if the attacked cell is at a lower elevation
-                # harder to win if the attacked cell is at a higher elevation
-                if (self.elevation - spread_choice.elevation) > 0:
-                    elevation_modifier = (self.model.elevation_constant - math.log(self.elevation - spread_choice.elevation)) / self.model.elevation_constant
-                    if elevation_modifier <= 0:
-                        elevation_modifier = 0.01
-                elif (self.elevation - spread_choice.elevation) < 0:
-                    elevation_modifier = (self.model.elevation_constant + math.log(abs(self.elevation - spread_choice.elevation))) / self.model.elevation_constant
-                else:
-                    elevation_modifier = 1
-            else:
-                elevation_modifier = 1
-            chance /= elevation_modifier
+            chance /= self.elevation_modifier(spread_choice)
 
             if (random.random() * 100) <= chance:
                 spread_choice.add_technology(tech_choice)
@@ -159,88 +137,104 @@ class EmpireCell(mg.GeoAgent):
     # updates the asabiya of the cell
     def update_asabiya(self):
 
+        # the cell is a border cell if at least one of its neighbors is an enemy cell
+        # chiefdoms are always border cells
         if self.empire.id != 0:
-            # checks if the cell is a border cell
-            # iterates through each neighbor of the cell
-            for neighbor in self.neighbors:
-
-                # if at least one neighbor is found that is an enemy cell
-                # flags this cell as a border cell
-                if neighbor.empire.id != self.empire.id:
-                    border_cell = True
-                    break
-
-            # otherwise, flags this cell as a non-border cell
-            else:
-                border_cell = False
+            border_cell = self.enemy_neighbors > 0
         else:
             border_cell = True
 
         # grows or shrinks asabiya according to whether the cell is a border cell
         if border_cell:
-            self.asabiya += self.model.asa_growth * self.asabiya * (1 - self.asabiya)
+            self.set_asabiya(self.asabiya + self.model.asa_growth * self.asabiya * (1 - self.asabiya))
+        else:
+            self.set_asabiya(self.asabiya - self.model.asa_decay * self.asabiya)
+
+    # changes the asabiya of the cell and keeps the running totals of the empires listing it in step
+    def set_asabiya(self, asabiya):
+        for empire in self.listed_in:
+            empire.asa_total += asabiya - self.asabiya
+        self.asabiya = asabiya
+
+    def set_ultrasociality(self, ultrasociality):
+        for empire in self.listed_in:
+            empire.us_total += ultrasociality - self.ultrasociality
+        self.ultrasociality = ultrasociality
+
+    # damping of religious conversion by the cell's elevation
+    def religion_elevation_modifier(self):
+        if self.elevation > 0:
+            elev_mod = math.log(self.elevation, 10)
+            if elev_mod > 1:
+                elev_mod = 1 / elev_mod
         else:
-            self.asabiya -= self.model.asa_decay * self.asabiya
+            elev_mod = 1
+
+        return elev_mod
 
     def update_religion(self):
 
-        for religion in self.religions:
-            if religion.id != 0:
-                chance = religion.conv_chance * religion.conversion
+        registry = self.model.religion_registry
+        religion_ids = self.religion_ids
+        conversions = self.conversions
+
+        # the majority religion is always first in the lists
+        if self.majReligion is not None:
+            majority = registry[self.majReligion]
+        else:
+            majority = None
+
+        for index, religion_id in enumerate(religion_ids):
+            if religion_id != 0:
+                religion = registry[religion_id]
+                chance = religion.conv_chance * conversions[index]
 
                 for neighbor in self.neighbors:
-                    if neighbor.majReligion and (neighbor.majReligion.id == religion.id and neighbor.majReligion.id != 0):
+                    if neighbor.majReligion == religion_id:
                         chance += 0.025
 
-                if self.majReligion and religion != self.majReligion:
-                    tolerance_mod = self.majReligion.tolerance
+                if majority and religion_id != self.majReligion:
+                    tolerance_mod = majority.tolerance
                 else:
                     tolerance_mod = 1
 
-                if self.majReligion and self.majReligion.type == "non-pros":
-                    pros_mod = (1 - self.majReligion.conversion) / 2
+                if majority and majority.type == "non-pros":
+                    pros_mod = (1 - conversions[0]) / 2
                 else:
                     pros_mod = 1
 
-                if self.elevation > 0:
-                    elev_mod = math.log(self.elevation, 10)
-                    if elev_mod > 1:
-                        elev_mod = 1 / elev_mod
-                else:
-                    elev_mod = 1
-
-                if random.random() < chance * tolerance_mod * pros_mod * elev_mod:
-                    if religion.id == self.empire.religion.id:
+                if random.random() < chance * tolerance_mod * pros_mod * self.elev_mod:
+                    if religion_id == self.empire.religion.id:
                         conv_increase = 0.1
                     else:
                         conv_increase = 0.025
-                    religion.conversion += conv_increase
-                    for r in self.religions:
-                        if r.id != religion.id:
-                            r.conversion -= round(conv_increase / (len(self.religions) - 1), 3)
-
-        for religion in self.religions:
-            if religion.conversion < 0:
-                self.religions.remove(religion)
-            elif religion.conversion > 1:
-                religion.conversion = 1
-
-        self.religions.sort(reverse=True, key=lambda rel: rel.conversion)
-        self.majReligion = self.religions[0]
-
-        if self.majReligion.conversion < 0.5:
+                    conversions[index] += conv_increase
+                    self.model.changed_at[self.id] = self.model.steps
+                    if len(religion_ids) > 1:
+                        conv_decrease = round(conv_increase / (len(religion_ids) - 1), 3)
+                        for other in range(len(conversions)):
+                            if other != index:
+                                conversions[other] -= conv_decrease
+
+        # drops religions that have lost all their converts and caps the rest at full conversion
+        # then sorts them from most to least converted
+        religions = sorted(((religion_id, min(conversion, 1)) for religion_id, conversion in zip(religion_ids, conversions)
+                            if conversion >= 0), reverse=True, key=lambda religion: religion[1])
+        self.religion_ids = [religion_id for religion_id, conversion in religions]
+        self.conversions = [conversion for religion_id, conversion in religions]
+
+        if self.conversions[0] >= 0.5:
+            self.majReligion = self.religion_ids[0]
+        else:
             self.majReligion = None
 
     def update_ultrasociality(self):
-        self.ultrasociality += 0.25
-        if self.ultrasociality > 5:
-            self.ultrasociality = 5
+        self.set_ultrasociality(min(self.ultrasociality + 0.25, 5))
 
     def update_power(self):
-        if self.majReligion == self.empire.religion:
-            relMatchBonus = 1.2
-        else:
-            relMatchBonus = 1
+        # this compared the empire's religion with the cell's own deep copy of it, so it never matched
+        # left at 1 so runs stay comparable with earlier results
+        relMatchBonus = 1
 
         # sets power according to the Turchin equation
         # power = empire size * average empire asabiya * e^(-1 * distance to empire's center / power decline)
@@ -249,23 +243,12 @@ class EmpireCell(mg.GeoAgent):
         else:
             self.power = self.asabiya * (5 - self.ultrasociality)
 
+    # the attacked cell's elevation modifier
+    # easier to win if the attacked cell is at a lower elevation
+    # harder to win if the attacked cell is at a higher elevation
+    # precomputed for every neighbor by the world, see edge_elevation_modifiers
     def elevation_modifier(self, attack_choice):
-        if self.model.use_elevation:
-            # calculation of the attacked cell's elevation modifier
-            # easier to win if the attacked cell is at a lower elevation
-            # harder to win if the attacked cell is at a higher elevation
-            if (self.elevation - attack_choice.elevation) > 0:
-                elevation_modifier = (self.model.elevation_constant - math.log(self.elevation - attack_choice.elevation)) / self.model.elevation_constant
-                if elevation_modifier <= 0:
-                    elevation_modifier = 0.01
-            elif (self.elevation - attack_choice.elevation) < 0:
-                elevation_modifier = (self.model.elevation_constant + math.log(abs(self.elevation - attack_choice.elevation))) / self.model.elevation_constant
-            else:
-                elevation_modifier = 1
-        else:
-            elevation_modifier = 1
-
-        return elevation_modifier
+        return self.neighbor_modifiers[attack_choice.id]
 
         # allows the cell to attack one of its neighbors
 
@@ -287,11 +270,15 @@ class EmpireCell(mg.GeoAgent):
         # randomly chooses a neighbor to attack
         attack_choice = random.choice(enemy_neighbors)
 
-        # self.model.differences.append(round(self.power - (attack_choice.power * elevation_modifier), 2))
-
-        print(f"Difference: {self.power - (attack_choice.power * self.elevation_modifier(attack_choice) * attack_choice.fortification)}")
         # determines whether the difference power between the cells is greater than the delta_power value
-        if self.power - (attack_choice.power * self.elevation_modifier(attack_choice) * attack_choice.fortification) > self.model.delta_power:
+        difference = self.power - (attack_choice.power * self.elevation_modifier(attack_choice) * attack_choice.fortification)
+        won = difference > self.model.delta_power
+
+        # records the attack if the model is keeping a battle log
+        if self.model.battle_log is not None:
+            self.model.battle_log.record(self.model.steps, self.id, attack_choice.id, difference, won)
+
+        if won:
             if self.empire.id != 0:
                 # if it is, adds the attacked cell to the attacker's empire
 
@@ -302,20 +289,20 @@ class EmpireCell(mg.GeoAgent):
                 self.empire.add_cell(attack_choice)
 
                 # sets the attacked cell's asabiya to be the average of the two cells
-                attack_choice.asabiya = (self.asabiya + attack_choice.asabiya) / 2.0
+                attack_choice.set_asabiya((self.asabiya + attack_choice.asabiya) / 2.0)
             else:
-                self.model.empires.append(Empire(len(self.model.empires) + 1, self.model))
+                self.model.empires.append(Empire(self.model.new_empire_id(), self.model))
+                new_empire = self.model.empires[len(self.model.empires) - 1]
 
                 # adds both cells to the new empire
-                self.model.empires[len(self.model.empires) - 1].add_cell(self)
-                self.model.empires[len(self.model.empires) - 1].add_cell(attack_choice)
+                new_empire.add_cell(self)
+                new_empire.add_cell(attack_choice)
 
-                self.empire = self.model.empires[len(self.model.empires) - 1]
-
-                # removes the attacked cell from its previous empire
+                # removes the attacked cell from the new empire, as it was originally done
+                # both cells stay listed in their old empires, and the new empire only lists this cell,
+                # so runs stay comparable with earlier results
                 attack_choice.empire.remove_cell(attack_choice)
-                attack_choice.empire = self.empire
-                attack_choice.asabiya = (self.asabiya + attack_choice.asabiya) / 2.0
+                attack_choice.set_asabiya((self.asabiya + attack_choice.asabiya) / 2.0)
 
                 # updates the new empire
                 self.empire.update()
@@ -323,8 +310,15 @@ class EmpireCell(mg.GeoAgent):
     # cell actions each step
     def step(self):
 
-        choices = [neighbor for neighbor in self.neighbors if neighbor.empire.id != self.empire.id]
-        self.update_religion()
+        # only border cells have enemy neighbors to attack
+        if self.enemy_neighbors > 0:
+            choices = [neighbor for neighbor in self.neighbors if neighbor.empire.id != self.empire.id]
+        else:
+            choices = []
+
+        # religions are updated for all cells at once by the model's kernel when it has one
+        if self.model.religion_kernel is None:
+            self.update_religion()
         self.update_ultrasociality()
         self.update_asabiya()
         self.update_power()
@@ -0,0 +1,330 @@
+import json
+import random
+
+import numpy as np
+
+from agent_recorder import AgentRecorder
+from empire import Empire
+from reporter_sink import ReporterSink
+from religion import Religion
+from technology import *
+
+# per cell technology attributes, only present on cells that have had their technology cleared
+cell_technology_attributes = ["power_decline", "power_decline_bonus", "asa_growth", "asa_growth_bonus",
+                              "asa_decay", "asa_decay_bonus", "delta_power", "delta_power_bonus", "elevation_bonus"]
+
+# array engine state, saved as is
+engine_arrays = ["owner", "prev_owner", "asabiya", "ultrasociality", "power", "fortification", "times_changed_hands",
+                 "attack_chance", "empire_replicate", "empire_size", "center_x", "center_y", "average_asabiya", "average_us"]
+
+# model attributes that change over a run
+model_attributes = ["steps", "running", "delta_power_change", "avg_empire_area", "avg_empire_elevation",
+                    "area_histogram", "avg_difference", "battles_before_step", "starting_x", "starting_y",
+                    "next_empire_id"]
+
+
+# checkpoints of a running EuropeModel
+# the map, geometries and agents are not saved, they are rebuilt from the world template on restore,
+# and only the state that changes over a run is written out, as numpy arrays plus a small json header
+#
+# restoring a checkpoint and carrying on gives the same run, step for step, as never stopping
+
+
+def religion_traits(religion):
+    return {"id": religion.id, "type": religion.type, "tolerance": religion.tolerance,
+            "attack_chance": religion.attack_chance, "conv_chance": religion.conv_chance, "conversion": religion.conversion}
+
+
+def make_religion(traits):
+    religion = Religion(traits["id"])
+    religion.type = traits["type"]
+    religion.tolerance = traits["tolerance"]
+    religion.attack_chance = traits["attack_chance"]
+    religion.conv_chance = traits["conv_chance"]
+    religion.conversion = traits["conversion"]
+    return religion
+
+
+# puts a list of lists into flat CSR style arrays, the i-th list being values[offsets[i]:offsets[i + 1]]
+def flatten(lists, dtype):
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(values) for values in lists])
+    values = np.fromiter((value for values in lists for value in values), dtype=dtype, count=int(offsets[-1]))
+    return offsets, values
+
+
+def unflatten(offsets, values):
+    values = values.tolist()
+    return [values[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+# the states of every random number generator the model draws from
+def rng_states(model):
+    states = {"global": random.getstate(), "model": model.random.getstate()}
+    if model.engine:
+        states["engine"] = model.engine.rng.bit_generator.state
+    if model.religion_kernel is not None:
+        states["religion_kernel"] = model.religion_kernel.rng.bit_generator.state
+    return states
+
+
+# python random states are nested tuples, which json turns into lists
+def as_random_state(state):
+    return state[0], tuple(state[1]), state[2]
+
+
+def save_checkpoint(model, path):
+
+    header = {"parameters": {name: value for name, value in model.parameters.items()
+                             if name not in ("reporter_sink", "agent_recorder", "recording")},
+              "world": {"path": model.world.path, "size": model.world.size},
+              "model": {name: getattr(model, name) for name in model_attributes},
+              "schedule": {name: getattr(model.schedule, name) for name in ("steps", "time")},
+              "mesa": {name: getattr(model, name) for name in ("current_id", "_steps", "_time") if hasattr(model, name)},
+              "random": rng_states(model),
+              "default_religion": religion_traits(model.default_religion),
+              "religions": [religion_traits(religion) for religion in model.religion_registry.values()],
+              "reporters": model.datacollector.model_vars}
+    arrays = {}
+
+    if model.engine:
+        engine = model.engine
+        header["engine"] = {"empire_count": engine.empire_count}
+        for name in engine_arrays:
+            arrays[f"engine_{name}"] = getattr(engine, name)
+    else:
+        cells = model.cells
+
+        # an empire is dropped from the model's list once its own list of cells is empty,
+        # but the cell taken when it was founded is never in that list and can still belong to it,
+        # so empires that cells still belong to or are listed in are saved after the model's
+        empires = [model.default_empire] + model.empires
+        empire_index = {id(empire): index for index, empire in enumerate(empires)}
+        for cell in cells:
+            for empire in [cell.empire] + cell.listed_in:
+                if id(empire) not in empire_index:
+                    empire_index[id(empire)] = len(empires)
+                    empires.append(empire)
+        header["listed_empires"] = len(model.empires)
+
+        arrays["cell_empire"] = np.array([empire_index[id(cell.empire)] for cell in cells], dtype=np.int32)
+        arrays["cell_prev_empire_id"] = np.array([cell.prev_empire_id for cell in cells], dtype=np.int64)
+        arrays["cell_maj_religion"] = np.array([-1 if cell.majReligion is None else cell.majReligion for cell in cells], dtype=np.int64)
+        for name in ("asabiya", "power", "fortification", "ultrasociality", "times_changed_hands", "enemy_neighbors"):
+            arrays[f"cell_{name}"] = np.array([getattr(cell, name) for cell in cells], dtype=np.float64)
+        arrays["religion_offsets"], arrays["religion_ids"] = flatten([cell.religion_ids for cell in cells], np.int64)
+        _, arrays["conversions"] = flatten([cell.conversions for cell in cells], np.float64)
+
+        # empire memberships, in the order the cells joined
+        arrays["member_offsets"], arrays["members"] = flatten([list(empire.cells) for empire in empires], np.int64)
+        header["empires"] = [{"id": empire.id, "color": empire.color, "religion": empire.religion.id, "size": empire.size,
+                              "center": empire.center, "average_asabiya": empire.average_asabiya, "average_us": empire.average_us,
+                              "totals": [empire.x_total, empire.y_total, empire.asa_total, empire.us_total],
+                              "updates_since_recalculation": empire.updates_since_recalculation}
+                             for empire in empires]
+
+        header["technologies"] = [{"class": type(tech).__name__, "cell": tech.cell.id, "value": tech.value,
+                                   "type": getattr(tech, "type", None), "tech_id": tech.tech_id}
+                                  for tech in model.techs_dropped]
+        header["cell_technology"] = {str(cell.id): {"technology": [tech.tech_id for tech in cell.technology],
+                                                    **{name: getattr(cell, name) for name in cell_technology_attributes}}
+                                     for cell in cells if hasattr(cell, "technology")}
+
+    if model.battle_log is not None:
+        arrays["battles"] = model.battle_log.records()
+        header["battle_count"] = model.battle_log.count
+
+    # the partition and cell directory the run is writing to are flushed, so they hold every step up to the checkpoint
+    # and a restored run can carry on in them
+    header["outputs"] = {}
+    if model.reporter_sink is not None:
+        model.reporter_sink.flush()
+        header["outputs"]["reporter_sink"] = [model.reporter_sink.directory, model.reporter_sink.rows]
+    if model.agent_recorder is not None:
+        model.agent_recorder.flush()
+        header["outputs"]["agent_recorder"] = [model.agent_recorder.directory, model.agent_recorder.steps]
+
+    # agent reporter rows, (step, cell id, reporter values...) each, in the order they were collected
+    agent_records = model.datacollector._agent_records
+    header["agent_record_counts"] = [[step, len(records)] for step, records in agent_records.items()]
+    arrays["agent_records"] = np.array([record for records in agent_records.values() for record in records], dtype=np.float64)
+
+    # the windows the convergence check compares, so a restored run stops at the same step
+    if model.convergence is not None:
+        convergence = model.convergence
+        header["convergence"] = {"history": {name: [float(value) for value in values] for name, values in convergence.history.items()},
+                                 "stop_step": convergence.stop_step, "statistics": convergence.statistics}
+
+    np.savez_compressed(path, header=np.array(json.dumps(header)), **arrays)
+
+
+# rebuilds a model from a checkpoint
+# keyword arguments override the model's saved constructor arguments,
+# e.g. to give the restored run its own reporter_sink or agent_recorder or recording directory
+#
+# a reporter_sink or agent_recorder directory that the checkpointed run was writing to is resumed:
+# it is cut back to the steps written up to the checkpoint, dropping any written after it, and carried on from there
+# any other directory, and always a recording, is started empty and only holds the steps after the checkpoint
+def load_checkpoint(path, **overrides):
+    from model import EuropeModel
+
+    with np.load(path, allow_pickle=False) as data:
+        header = json.loads(str(data["header"]))
+        arrays = {name: data[name] for name in data.files if name != "header"}
+
+    # outputs to resume are left out when the model is built, as building them would empty them
+    parameters = {**header["parameters"], **overrides}
+    resumed = {name: saved for name, saved in header["outputs"].items() if parameters.get(name) == saved[0]}
+    for name in resumed:
+        parameters[name] = None
+
+    # building the model draws random numbers, but every generator is put back to its saved state at the end
+    model = EuropeModel(**parameters)
+
+    if "reporter_sink" in resumed:
+        directory, rows = resumed["reporter_sink"]
+        model.reporter_sink = ReporterSink(directory, model.datacollector.model_reporters, resume_rows=rows)
+    if "agent_recorder" in resumed:
+        directory, steps = resumed["agent_recorder"]
+        model.agent_recorder = AgentRecorder(directory, model.world, resume_steps=steps)
+        model.datacollector.agent_reporters = {}
+    for name, (directory, count) in resumed.items():
+        model.parameters[name] = directory
+
+    # the cell arrays only line up with the map they were saved from
+    world = header["world"]
+    if model.world.path != world["path"] or model.world.size != world["size"]:
+        raise ValueError(f"checkpoint was saved on {world['path']} ({world['size']} cells), "
+                         f"not {model.world.path} ({model.world.size} cells)")
+
+    for name, value in header["model"].items():
+        setattr(model, name, value)
+    for name, value in header["schedule"].items():
+        setattr(model.schedule, name, value)
+    for name, value in header["mesa"].items():
+        setattr(model, name, value)
+    model.datacollector.model_vars = header["reporters"]
+
+    agent_records = arrays["agent_records"].tolist()
+    start = 0
+    model.datacollector._agent_records = {}
+    for step, count in header["agent_record_counts"]:
+        model.datacollector._agent_records[step] = [(int(record[0]), int(record[1]), *record[2:])
+                                                    for record in agent_records[start:start + count]]
+        start += count
+
+    default_religion = make_religion(header["default_religion"])
+    registry = {traits["id"]: make_religion(traits) for traits in header["religions"]}
+
+    if "engine" in header:
+        engine = model.engine
+        engine.empire_count = header["engine"]["empire_count"]
+        for name in engine_arrays:
+            setattr(engine, name, arrays[f"engine_{name}"])
+    else:
+        restore_cells(model, header, arrays, default_religion, registry)
+
+    # religions are put back after the empires, as building an empire registers a new religion
+    model.default_religion = default_religion
+    model.religion_registry = registry
+    model.religions = [religion for religion_id, religion in registry.items() if religion_id != 0]
+
+    if model.battle_log is not None and "battles" in arrays:
+        battles = arrays["battles"]
+        log = model.battle_log
+        log.count = header["battle_count"]
+        log.entries[(log.count - len(battles) + np.arange(len(battles))) % log.capacity] = battles
+
+    if model.convergence is not None and "convergence" in header:
+        convergence = model.convergence
+        for name, values in header["convergence"]["history"].items():
+            convergence.history[name].clear()
+            convergence.history[name].extend(values)
+        convergence.stop_step = header["convergence"]["stop_step"]
+        convergence.statistics = header["convergence"]["statistics"]
+
+    states = header["random"]
+    random.setstate(as_random_state(states["global"]))
+    model.random.setstate(as_random_state(states["model"]))
+    if "engine" in states:
+        model.engine.rng.bit_generator.state = states["engine"]
+    if "religion_kernel" in states:
+        model.religion_kernel.rng.bit_generator.state = states["religion_kernel"]
+
+    return model
+
+
+# puts the cells and empires of the object engine back the way they were saved
+def restore_cells(model, header, arrays, default_religion, registry):
+
+    cells = model.cells
+    cells_by_id = {cell.id: cell for cell in cells}
+
+    # empires, the default empire first
+    empires = []
+    for index, saved in enumerate(header["empires"]):
+        empire = model.default_empire if index == 0 else Empire(saved["id"], model)
+        empire.id = saved["id"]
+        empire.color = saved["color"]
+        empire.religion = default_religion if index == 0 else registry[saved["religion"]]
+        empire.attack_chance = empire.religion.attack_chance
+        empire.size = saved["size"]
+        empire.center = tuple(saved["center"])
+        empire.average_asabiya = saved["average_asabiya"]
+        empire.average_us = saved["average_us"]
+        empire.x_total, empire.y_total, empire.asa_total, empire.us_total = saved["totals"]
+        empire.updates_since_recalculation = saved["updates_since_recalculation"]
+        empires.append(empire)
+    model.default_empire = empires[0]
+    model.empires = empires[1:1 + header["listed_empires"]]
+
+    # cells
+    religion_ids = unflatten(arrays["religion_offsets"], arrays["religion_ids"])
+    conversions = unflatten(arrays["religion_offsets"], arrays["conversions"])
+    for index, cell in enumerate(cells):
+        cell.empire = empires[arrays["cell_empire"][index]]
+        cell.color = cell.empire.color
+        cell.prev_empire_id = int(arrays["cell_prev_empire_id"][index])
+        maj_religion = int(arrays["cell_maj_religion"][index])
+        cell.majReligion = None if maj_religion < 0 else maj_religion
+        cell.religion_ids = religion_ids[index]
+        cell.conversions = conversions[index]
+        cell.asabiya = float(arrays["cell_asabiya"][index])
+        cell.power = float(arrays["cell_power"][index])
+        cell.fortification = float(arrays["cell_fortification"][index])
+        cell.ultrasociality = float(arrays["cell_ultrasociality"][index])
+        cell.times_changed_hands = int(arrays["cell_times_changed_hands"][index])
+        cell.enemy_neighbors = int(arrays["cell_enemy_neighbors"][index])
+
+    # empire memberships and frontier sets
+    for cell in cells:
+        cell.listed_in = []
+    for empire, members in zip(empires, unflatten(arrays["member_offsets"], arrays["members"])):
+        empire.cells = {cell_id: cells_by_id[cell_id] for cell_id in members}
+        for cell in empire.cells.values():
+            cell.listed_in.append(empire)
+        empire.border_cells = {}
+        empire.interior_cells = {}
+        for cell in empire.cells.values():
+            empire.file_cell(cell)
+
+    # technologies
+    technology_classes = {"AsabiyaTechnology": AsabiyaTechnology, "ElevationTechnology": ElevationTechnology,
+                          "PowerDeclineTechnology": PowerDeclineTechnology, "DeltaPowerTechnology": DeltaPowerTechnology}
+    technologies = {}
+    model.techs_dropped = []
+    for saved in header["technologies"]:
+        tech_class = technology_classes[saved["class"]]
+        cell = cells_by_id[saved["cell"]]
+        if tech_class is AsabiyaTechnology:
+            tech = tech_class(cell, saved["value"], saved["type"], saved["tech_id"])
+        else:
+            tech = tech_class(cell, saved["value"], saved["tech_id"])
+        technologies[tech.tech_id] = tech
+        model.techs_dropped.append(tech)
+
+    for cell_id, saved in header["cell_technology"].items():
+        cell = cells_by_id[int(cell_id)]
+        cell.technology = [technologies[tech_id] for tech_id in saved["technology"]]
+        for name in cell_technology_attributes:
+            setattr(cell, name, saved[name])
@@ -0,0 +1,60 @@
+from collections import deque
+
+import numpy as np
+
+# reporters watched for convergence
+watched_series = ["Average Empire Area (Hexes)", "Number of Empires"]
+
+
+# stopping rule for batch runs
+# keeps the last two windows of each watched series, and calls the run stationary once,
+# for every series, the mean of the later window is within tolerance of the earlier one (relative to it)
+# and the variances of the two windows are within variance_ratio of each other
+class ConvergenceCheck:
+
+    def __init__(self, window, tolerance=0.05, variance_ratio=2):
+        self.window = window
+        self.tolerance = tolerance
+        self.variance_ratio = variance_ratio
+        self.history = {name: deque(maxlen=2 * window) for name in watched_series}
+
+        # step the run was stopped at and the statistics that stopped it, None until it converges
+        self.stop_step = None
+        self.statistics = None
+
+    # adds a step's values and returns whether every series is stationary
+    def update(self, step, values):
+        for name in watched_series:
+            self.history[name].append(values[name])
+
+        if len(self.history[watched_series[0]]) < 2 * self.window:
+            return False
+
+        statistics = {}
+        for name in watched_series:
+            series = np.array(self.history[name], dtype=np.float64)
+            before, after = series[:self.window], series[self.window:]
+            mean_before, mean_after = before.mean(), after.mean()
+            var_before, var_after = before.var(), after.var()
+
+            if abs(mean_after - mean_before) > self.tolerance * max(abs(mean_before), 1e-9):
+                return False
+
+            # two flat windows count as the same variance
+            if max(var_before, var_after) > self.variance_ratio * min(var_before, var_after) and max(var_before, var_after) > 1e-12:
+                return False
+
+            statistics[name] = {"mean before": float(mean_before), "mean after": float(mean_after),
+                                "variance before": float(var_before), "variance after": float(var_after)}
+
+        self.stop_step = step
+        self.statistics = statistics
+        return True
+
+    # flat stop step and statistics, to go into a row of batch output
+    def totals(self):
+        row = {"convergence stop step": self.stop_step}
+        for name in watched_series:
+            for statistic in ("mean before", "mean after", "variance before", "variance after"):
+                row[f"convergence {name} {statistic}"] = self.statistics[name][statistic] if self.statistics else None
+        return row
@@ -0,0 +1,50 @@
+// browser side of DeltaMapModule in delta_map.py
+// keeps a circle marker per cell and only restyles the cells sent in each frame
+const DeltaMap = function (view, zoom, mapWidth, mapHeight, tileUrl, attribution) {
+  const div = document.createElement("div");
+  div.style.width = mapWidth + "px";
+  div.style.height = mapHeight + "px";
+  document.getElementById("elements").appendChild(div);
+
+  const map = L.map(div, { preferCanvas: true }).setView(view, zoom);
+  L.tileLayer(tileUrl, { attribution: attribution }).addTo(map);
+
+  let markers = [];
+  let palette = [];
+
+  const clear = function () {
+    markers.forEach(function (marker) {
+      marker.remove();
+    });
+    markers = [];
+    palette = [];
+  };
+
+  this.render = function (frame) {
+    // the first frame of a model has the position of every cell
+    if (frame.cells) {
+      clear();
+      markers = frame.cells.map(function (position) {
+        return L.circleMarker(position, { radius: 2, weight: 1 })
+          .bindTooltip("(" + position[1].toFixed(2) + ", " + position[0].toFixed(2) + ")")
+          .addTo(map);
+      });
+    }
+
+    palette = palette.concat(frame.palette);
+
+    // [cell, color, fill color, fill opacity in tenths] for every cell that changed
+    const changes = frame.changes;
+    for (let i = 0; i < changes.length; i += 4) {
+      markers[changes[i]].setStyle({
+        color: palette[changes[i + 1]],
+        fillColor: palette[changes[i + 2]],
+        fillOpacity: changes[i + 3] / 10,
+      });
+    }
+  };
+
+  this.reset = function () {
+    clear();
+  };
+};
@@ -0,0 +1,139 @@
+import json
+
+import mesa_geo.visualization
+import numpy as np
+from mesa.visualization.ModularVisualization import ModularServer, SocketHandler
+
+
+# map of the cells that only sends what changed each tick
+# the first frame a browser gets of a model has the position of every cell,
+# and every frame after that only has the cells whose style changed since that browser's last one
+#
+# a style is a (color, fill color, fill opacity) tuple from style_method, and is sent as
+# [cell index, color, fill color, fill opacity in tenths] with both colors as indices into a palette,
+# the palette only sending the colors the browser has not seen yet
+#
+# the model marks in changed_at the step each cell last changed hands, religion or display,
+# so only those cells are restyled instead of every cell every frame
+# what each browser is showing is kept per connection by DeltaMapServer,
+# and a render without a connection, e.g. from a plain ModularServer, is always a full frame
+class DeltaMapModule(mesa_geo.visualization.MapModule):
+
+    def __init__(self, style_method, view, zoom, tiles, map_width=900, map_height=600):
+        super().__init__(lambda agent: {}, view, zoom, tiles=tiles, map_width=map_width, map_height=map_height)
+        self.style_method = style_method
+
+        self.local_includes = list(self.local_includes) + ["delta_map.js"]
+        attribution = tiles.get("html_attribution", tiles.get("attribution", ""))
+        self.js_code = (f"elements.push(new DeltaMap({json.dumps(list(view))}, {zoom}, {map_width}, {map_height}, "
+                        f"{json.dumps(tiles.build_url())}, {json.dumps(attribution)}));")
+
+        # what each browser is showing, keyed by its connection
+        self.views = {}
+
+    def view_of(self, client):
+        if client is None:
+            return MapView()
+        if client not in self.views:
+            self.views[client] = MapView()
+        return self.views[client]
+
+    def forget(self, client):
+        self.views.pop(client, None)
+
+    # the positions of the cells if the browser has not seen the model yet,
+    # and the styles of the cells that changed since the browser's last frame
+    # this is all the frame reads from the model, so it is the only part that needs the model to hold still
+    def snapshot(self, model, client=None):
+        view = self.view_of(client)
+
+        if model is not view.model:
+            view.model = model
+            view.styles = [None] * len(model.cells)
+            view.palette = {}
+            positions = [[round(cell.y, 4), round(cell.x, 4)] for cell in model.cells]
+            changed = range(len(model.cells))
+        else:
+            positions = None
+            changed = np.flatnonzero(model.changed_at > view.drawn_step).tolist()
+        view.drawn_step = model.steps
+
+        styles = []
+        for index in changed:
+            style = self.style_method(model.cells[index])
+            if style != view.styles[index]:
+                view.styles[index] = style
+                styles.append((index, style))
+        return positions, styles
+
+    # the frame sent to the browser for a snapshot
+    def frame(self, snapshot, client=None):
+        view = self.view_of(client)
+        positions, styles = snapshot
+
+        frame = {}
+        if positions is not None:
+            frame["cells"] = positions
+
+        new_colors = []
+        changes = []
+        for index, style in styles:
+            changes += [index, view.color_index(style[0], new_colors), view.color_index(style[1], new_colors),
+                        round(style[2] * 10)]
+
+        frame["palette"] = new_colors
+        frame["changes"] = changes
+        return frame
+
+    def render(self, model, client=None):
+        return self.frame(self.snapshot(model, client), client)
+
+
+# what a browser is showing of a model
+class MapView:
+
+    def __init__(self):
+        self.model = None
+        self.drawn_step = -1
+        self.styles = []
+        self.palette = {}
+
+    def color_index(self, color, new_colors):
+        if color not in self.palette:
+            self.palette[color] = len(self.palette)
+            new_colors.append(color)
+        return self.palette[color]
+
+
+# websocket handler that renders the model for its own connection
+class DeltaSocketHandler(SocketHandler):
+
+    @property
+    def viz_state_message(self):
+        return {"type": "viz_state", "data": self.application.render_model(self)}
+
+    def on_close(self):
+        self.application.forget_client(self)
+
+
+# ModularServer that keeps the delta maps' state per browser connection,
+# so a second tab or a reload gets a full frame instead of changes against another browser's map
+class DeltaMapServer(ModularServer):
+
+    socket_handler = DeltaSocketHandler
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        for rule in self.wildcard_router.rules:
+            if rule.target is SocketHandler:
+                rule.target = self.socket_handler
+
+    def render_model(self, client=None):
+        return [element.render(self.model, client) if isinstance(element, DeltaMapModule) else element.render(self.model)
+                for element in self.visualization_elements]
+
+    def forget_client(self, client):
+        for element in self.visualization_elements:
+            if isinstance(element, DeltaMapModule):
+                element.forget(client)
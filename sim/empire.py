@@ -1,5 +1,4 @@
 import random
-from copy import deepcopy
 from religion import *
 
 
@@ -7,22 +6,47 @@ from religion import *
 # mainly holds cells
 class Empire:
 
+    # number of property updates between exact recalculations of the running totals
+    # bounds the floating point drift from adding and subtracting cell values
+    recalculation_interval = 100
+
     def __init__(self, unique_id, model):
 
         self.model = model
-        self.cells = []
+
+        # cells held by the empire, keyed by cell id
+        # dicts keep insertion order, so cells are iterated in the order they joined,
+        # the same as the list this used to be, but membership checks and removal are constant time
+        self.cells = {}
+
+        # frontier index over the cells in the empire, keyed by cell id
+        # border cells have at least one neighbor in another empire, interior cells have none
+        # kept up to date by add_cell, so nothing has to rescan neighbors to find the border
+        self.border_cells = {}
+        self.interior_cells = {}
+
         self.size = 0
         self.center = (None, None)
         self.id = unique_id
         self.average_asabiya = 0
         self.average_us = 0
 
+        # running totals over the cells in the empire's list
+        # kept up to date as cells join and leave and as their asabiya and ultrasociality change,
+        # so the averages and center can be read without going over every cell
+        self.x_total = 0
+        self.y_total = 0
+        self.asa_total = 0
+        self.us_total = 0
+        self.updates_since_recalculation = 0
+
         if self.id != 0:
             if len(self.model.religions) > 0:
                 self.religion = Religion(self.model.religions[len(self.model.religions) - 1].id + 1)
             else:
                 self.religion = Religion(1)
             self.model.religions.append(self.religion)
+            self.model.religion_registry[self.religion.id] = self.religion
         else:
             self.religion = self.model.default_religion
         self.attack_chance = self.religion.attack_chance
@@ -32,29 +56,80 @@ class Empire:
 
     # adds a cell to this empire
     def add_cell(self, cell):
-        self.cells.append(cell)
         cell.times_changed_hands += 1
-        for religion in cell.religions:
-            if religion.id == self.id:
-                break
-        else:
-            cell.religions.append(deepcopy(self.religion))
-            cell.religions[len(cell.religions) - 1].conversion = 0.25 * cell.religions[0].conversion
-            cell.religions[0].conversion *= 0.75
+        self.model.changed_at[cell.id] = self.model.steps
+
+        # the cell picks up the empire's religion at a quarter of its majority religion's conversion
+        if self.religion.id not in cell.religion_ids:
+            cell.religion_ids.append(self.religion.id)
+            cell.conversions.append(0)
+            cell.conversions[len(cell.conversions) - 1] = 0.25 * cell.conversions[0]
+            cell.conversions[0] *= 0.75
 
-        if cell.ultrasociality > 0 or cell.prev_empire.id == self.id:
-            cell.ultrasociality *= -1
+        if cell.ultrasociality > 0 or cell.prev_empire_id == self.id:
+            cell.set_ultrasociality(-cell.ultrasociality)
         else:
-            cell.ultrasociality = 0
+            cell.set_ultrasociality(0)
+
+        # the cell can still be listed here if it was taken from this empire by a chiefdom founding a new one
+        if cell.id not in self.cells:
+            self.cells[cell.id] = cell
+            cell.listed_in.append(self)
 
-        cell.prev_empire = cell.empire
+            self.x_total += cell.x
+            self.y_total += cell.y
+            self.asa_total += cell.asabiya
+            self.us_total += cell.ultrasociality
+
+        old_empire = cell.empire
+        cell.prev_empire_id = cell.empire.id
         cell.empire = self
         cell.color = self.color
 
+        self.update_frontier(cell, old_empire)
+
+    # recounts the enemy neighbors of a cell that has just joined this empire from old_empire
+    # and of each of its neighbors whose relation to it changed
+    def update_frontier(self, cell, old_empire):
+        enemy_neighbors = 0
+        for neighbor in cell.neighbors:
+            was_enemy = neighbor.empire.id != old_empire.id
+            is_enemy = neighbor.empire.id != self.id
+            if is_enemy:
+                enemy_neighbors += 1
+
+            if was_enemy != is_enemy:
+                neighbor.enemy_neighbors += 1 if is_enemy else -1
+                neighbor.empire.file_cell(neighbor)
+
+        cell.enemy_neighbors = enemy_neighbors
+        self.file_cell(cell)
+
+    # puts a cell of this empire in the border or interior set according to its enemy neighbor count
+    def file_cell(self, cell):
+
+        # cells that are between empires are filed when they are added to their new one
+        if cell.id not in self.cells:
+            return
+
+        if cell.enemy_neighbors > 0:
+            self.interior_cells.pop(cell.id, None)
+            self.border_cells[cell.id] = cell
+        else:
+            self.border_cells.pop(cell.id, None)
+            self.interior_cells[cell.id] = cell
+
     # removes a cell from this empire
     def remove_cell(self, cell):
-        if cell in self.cells:
-            self.cells.remove(cell)
+        if self.cells.pop(cell.id, None) is not None:
+            cell.listed_in.remove(self)
+            self.border_cells.pop(cell.id, None)
+            self.interior_cells.pop(cell.id, None)
+
+            self.x_total -= cell.x
+            self.y_total -= cell.y
+            self.asa_total -= cell.asabiya
+            self.us_total -= cell.ultrasociality
 
     # updates size according to the number of cells held
     # also updates the area histogram accordingly
@@ -73,21 +148,29 @@ class Empire:
             else:
                 self.model.area_histogram[self.size // 50] += 1
 
+    # resums the running totals from the cells in the empire
+    def recalculate_totals(self):
+        self.x_total = 0
+        self.y_total = 0
+        self.asa_total = 0
+        self.us_total = 0
+        for cell in self.cells.values():
+            self.x_total += cell.x
+            self.y_total += cell.y
+            self.asa_total += cell.asabiya
+            self.us_total += cell.ultrasociality
+
+        self.updates_since_recalculation = 0
+
     def update_properties(self):
-        # sums the x and y coordinates of all cells in the empire
-        x_total = 0
-        y_total = 0
-        asa_total = 0
-        us_total = 0
-        for cell in self.cells:
-            x_total += cell.x
-            y_total += cell.y
-            asa_total += cell.asabiya
-            us_total += cell.ultrasociality
-
-        self.average_asabiya = asa_total / len(self.cells)
-        self.center = round(x_total / len(self.cells)), round(y_total / len(self.cells))
-        self.average_us = us_total / len(self.cells)
+        self.updates_since_recalculation += 1
+        if self.updates_since_recalculation >= self.recalculation_interval:
+            self.recalculate_totals()
+
+        # averages the running totals of all cells in the empire
+        self.average_asabiya = self.asa_total / len(self.cells)
+        self.center = round(self.x_total / len(self.cells)), round(self.y_total / len(self.cells))
+        self.average_us = self.us_total / len(self.cells)
 
     # compiled update function
     def update(self):
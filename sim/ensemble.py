@@ -0,0 +1,108 @@
+import os
+import random
+
+import numpy as np
+
+from array_engine import ArrayEngine
+from reporter_sink import ReporterSink
+from world import load_world
+
+hex_to_meters = 863000000
+
+# reporters kept for every replicate, the array engine's subset of the model's batch reporters
+reporter_names = ["starting x", "starting y", "steps", "Average Empire Area (Hexes)", "Average Empire Area (m^2)",
+                  "Number of Empires", "5-50 Hexes", "51-100 Hexes", "101-150 Hexes", "151-200 Hexes", "201-250 Hexes",
+                  "251-300 Hexes", "301-350 Hexes", "351-400 Hexes", "401-450 Hexes", "451-500 Hexes", "501-550 Hexes",
+                  "551-600 Hexes", "601 or more Hexes", "Elevation Constant"]
+
+
+# steps many replicates of the array engine together, in lockstep, over the same map
+# every step is one pass of the array engine's maths over all of them instead of a python model each,
+# and the state reads as (replicates, cells) arrays through the batched properties
+#
+# the parameters can be a single value or one value per replicate,
+# so an ensemble can hold the iterations of one parameter point or several points at once
+class EnsembleEngine(ArrayEngine):
+
+    def __init__(self, replicates, power_decline=4, delta_power=0.1, asa_growth=0.2, asa_decay=0.1,
+                 elevation_constant=6.5, use_elevation=True, seed=None, reporter_sink=None, world=None):
+
+        if seed is not None:
+            random.seed(seed)
+
+        world = world if world is not None else load_world()
+        self.cells = world.size
+        self.steps = 0
+
+        # the elevation constant as given, the engine keeps the one the model uses internally
+        self.elevation_setting = np.broadcast_to(np.asarray(elevation_constant, dtype=np.float64), (replicates,)).copy()
+
+        super().__init__(None, world, replicates, {"power_decline": power_decline, "delta_power": delta_power,
+                                                   "asa_growth": asa_growth, "asa_decay": asa_decay,
+                                                   "elevation_constant": 10 - self.elevation_setting,
+                                                   "use_elevation": use_elevation})
+
+        # reporter series of every replicate, in the data collector's {name: [value per step]} form,
+        # or streamed to a partition per replicate when reporter_sink is a directory
+        if reporter_sink is not None:
+            self.sinks = [ReporterSink(os.path.join(reporter_sink, f"replicate_{r}"), reporter_names) for r in range(replicates)]
+            self.model_vars = None
+        else:
+            self.sinks = None
+            self.model_vars = [{name: [] for name in reporter_names} for r in range(replicates)]
+
+    # batched views of the cell state, one row per replicate
+    @property
+    def batched_owner(self):
+        return self.owner.reshape(self.replicates, self.cells)
+
+    @property
+    def batched_asabiya(self):
+        return self.asabiya.reshape(self.replicates, self.cells)
+
+    @property
+    def batched_times_changed_hands(self):
+        return self.times_changed_hands.reshape(self.replicates, self.cells)
+
+    # records the reporters of every replicate for this step
+    def collect(self):
+        for r in range(self.replicates):
+            row = {"starting x": self.starting_x[r], "starting y": self.starting_y[r], "steps": self.steps,
+                   "Average Empire Area (Hexes)": self.avg_empire_area[r],
+                   "Average Empire Area (m^2)": self.avg_empire_area[r] * hex_to_meters,
+                   "Number of Empires": int(self.empire_counts[r]),
+                   "Elevation Constant": self.elevation_constant[r]}
+            row.update(zip(reporter_names[6:19], self.area_histogram[r].tolist()))
+
+            if self.sinks is not None:
+                self.sinks[r].append(row)
+            else:
+                for name in reporter_names:
+                    self.model_vars[r][name].append(row[name])
+
+    # a step of every replicate, in the same order as EuropeModel.step with the array engine
+    def step(self):
+        self.steps += 1
+        self.update_empires()
+        self.collect()
+        super().step()
+
+    # writes out anything the reporter sinks are still holding
+    def close(self):
+        if self.sinks is not None:
+            for sink in self.sinks:
+                sink.close()
+
+    # a row of parameters and final reporter values for every replicate, like mesa's batch_run gives
+    def results(self):
+        rows = []
+        for r in range(self.replicates):
+            row = {"iteration": r, "Step": self.steps, "power_decline": self.power_decline[r], "delta_power": self.delta_power[r],
+                   "asa_growth": self.asa_growth[r], "asa_decay": self.asa_decay[r],
+                   "elevation_constant": self.elevation_setting[r], "use_elevation": bool(self.use_elevation[r])}
+            if self.sinks is not None:
+                row.update(self.sinks[r].last_row or {})
+            else:
+                row.update({name: values[-1] for name, values in self.model_vars[r].items() if values})
+            rows.append(row)
+        return rows
@@ -0,0 +1,213 @@
+import json
+import math
+import os
+import struct
+import sys
+
+import numpy as np
+
+from adjacency import find_coastal
+
+# builds a world file at any hex spacing from the elevation rasters in gis_data,
+# instead of going through the R scripts and the GeoJSON map
+# usage: python ingest.py <spacing in km> <output.npz> [raster.tif]
+#
+# the hex grid covers the same lon / lat bounds as the GeoJSON map, with rows of constant latitude,
+# each cell takes the mean elevation of the raster pixels under it, and cells that are mostly sea are left out
+# the world file holds the coordinates, elevation, adjacency and coastal mask of the cells,
+# and is loaded with load_world like the GeoJSON map is, e.g. EuropeModel(map_file="gis_data/hex_40km.npz")
+
+# rasters that ship in gis_data, finest first, with their pixel size in degrees
+rasters = [("gis_data/elevation_2-5.tif", 2.5 / 60), ("gis_data/elevation_5.tif", 5 / 60), ("gis_data/elevation_10.tif", 10 / 60)]
+
+# lon / lat bounds of the GeoJSON map
+bounds = (-10.234616, 26.252469, 47.995073, 62.261106)
+
+km_per_degree = 111.32
+
+# bump this whenever the layout of the world file or the way its contents are worked out changes
+# world files of another version are rejected by load_world, and have to be built again
+WORLD_FILE_VERSION = 2
+
+# geotiff tags read by Raster
+tiff_types = {1: "B", 2: "s", 3: "H", 4: "I", 11: "f", 12: "d", 16: "Q"}
+tiff_sizes = {1: 1, 2: 1, 3: 2, 4: 4, 11: 4, 12: 8, 16: 8}
+sample_types = {(1, 8): np.uint8, (1, 16): np.uint16, (2, 16): np.int16, (2, 32): np.int32, (3, 32): np.float32, (3, 64): np.float64}
+
+
+# a single band, north up geotiff, read without loading all of it
+# uncompressed files with their strips back to back, like the ones in gis_data, are memory mapped,
+# and anything else is read a window at a time through rasterio
+class Raster:
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            tags, byte_order = self.read_tags(file)
+
+        self.width = tags[256][0]
+        self.height = tags[257][0]
+        scale, tiepoint = tags[33550], tags[33922]
+        self.pixel_width, self.pixel_height = scale[0], scale[1]
+        self.left, self.top = tiepoint[3], tiepoint[4]
+        self.nodata = float(tags[42113].strip("\x00")) if 42113 in tags else None
+
+        bits = tags[258][0]
+        sample_format = tags[339][0] if 339 in tags else 1
+        dtype = np.dtype(sample_types[(sample_format, bits)]).newbyteorder(byte_order)
+
+        offsets, counts = tags.get(273, ()), tags.get(279, ())
+        contiguous = (tags.get(259, (1,))[0] == 1 and len(offsets) > 0 and
+                      all(offsets[i] + counts[i] == offsets[i + 1] for i in range(len(offsets) - 1)))
+        if contiguous:
+            self.data = np.memmap(path, dtype=dtype, mode="r", offset=offsets[0], shape=(self.height, self.width))
+            self.dataset = None
+        else:
+            import rasterio
+
+            self.data = None
+            self.dataset = rasterio.open(path)
+
+    # the tags of the first image in the file, as tuples of values
+    @staticmethod
+    def read_tags(file):
+        byte_order = "<" if file.read(2) == b"II" else ">"
+        magic, first = struct.unpack(byte_order + "HI", file.read(6))
+
+        file.seek(first)
+        count = struct.unpack(byte_order + "H", file.read(2))[0]
+        entries = [struct.unpack(byte_order + "HHI4s", file.read(12)) for _ in range(count)]
+
+        tags = {}
+        for tag, tag_type, length, value in entries:
+            size = tiff_sizes.get(tag_type, 1) * length
+            if size > 4:
+                file.seek(struct.unpack(byte_order + "I", value)[0])
+                value = file.read(size)
+            if tag_type == 2:
+                tags[tag] = value[:length].decode("ascii", errors="replace")
+            elif tag_type in tiff_types:
+                tags[tag] = struct.unpack(byte_order + tiff_types[tag_type] * length, value[:size])
+        return tags, byte_order
+
+    # pixel rows [top, bottom) of the raster
+    def rows(self, top, bottom):
+        top, bottom = max(top, 0), min(bottom, self.height)
+        if self.data is not None:
+            return np.asarray(self.data[top:bottom], dtype=np.float64)
+
+        from rasterio.windows import Window
+        return self.dataset.read(1, window=Window(0, top, self.width, bottom - top)).astype(np.float64)
+
+
+# the coarsest bundled raster with pixels no bigger than a third of the spacing, or the finest if none are
+def pick_raster(spacing, latitude):
+    km_per_pixel = [(path, pixel * km_per_degree * math.cos(math.radians(latitude))) for path, pixel in rasters]
+    fitting = [path for path, size in km_per_pixel if size <= spacing / 3]
+    return fitting[-1] if fitting else rasters[0][0]
+
+
+# hex grid centers over the bounds, rows of constant latitude spacing * sqrt(3) / 2 apart,
+# with every odd row shifted east by half a cell
+# like the GeoJSON map the grid is regular in degrees, with the spacing in km holding at the middle latitude,
+# as a longitude step that changed with latitude would break the columns apart between rows
+def hex_grid(spacing):
+    west, south, east, north = bounds
+    row_step = spacing * math.sqrt(3) / 2 / km_per_degree
+    column_step = spacing / (km_per_degree * math.cos(math.radians((south + north) / 2)))
+
+    latitudes = np.arange(north, south - 1e-9, -row_step)
+    columns = int(math.ceil((east - west) / column_step)) + 1
+    longitudes = west + (np.arange(columns)[None, :] + 0.5 * (np.arange(len(latitudes)) % 2)[:, None]) * column_step
+    return latitudes, longitudes, column_step, row_step
+
+
+# mean elevation of the raster pixels under every grid cell, and the share of them that is land
+# each grid row is read from the raster once, and the cells along it are summed from running totals of its columns
+def sample_elevation(raster, latitudes, longitudes, column_step, row_step):
+    elevation = np.zeros(longitudes.shape)
+    land = np.zeros(longitudes.shape)
+
+    for row, latitude in enumerate(latitudes):
+        top = int(math.floor((raster.top - (latitude + row_step / 2)) / raster.pixel_height))
+        bottom = int(math.ceil((raster.top - (latitude - row_step / 2)) / raster.pixel_height))
+        block = raster.rows(top, bottom)
+        if len(block) == 0:
+            continue
+
+        valid = block != raster.nodata if raster.nodata is not None else np.isfinite(block)
+        values = np.cumsum(np.concatenate(([0], np.where(valid, block, 0).sum(axis=0))))
+        counts = np.cumsum(np.concatenate(([0], valid.sum(axis=0))))
+
+        left = np.floor((longitudes[row] - column_step / 2 - raster.left) / raster.pixel_width).astype(np.intp)
+        right = np.ceil((longitudes[row] + column_step / 2 - raster.left) / raster.pixel_width).astype(np.intp)
+        left = np.clip(left, 0, raster.width)
+        right = np.clip(right, 0, raster.width)
+
+        pixels = (right - left) * len(block)
+        found = counts[right] - counts[left]
+        elevation[row] = np.where(found > 0, (values[right] - values[left]) / np.maximum(found, 1), 0)
+        land[row] = np.where(pixels > 0, found / np.maximum(pixels, 1), 0)
+
+    return elevation, land
+
+
+# neighbors of the kept cells on the hex grid, CSR style as in adjacency.py
+def hex_adjacency(keep):
+    rows, columns = keep.shape
+    index = np.full(keep.shape, -1, dtype=np.int64)
+    index[keep] = np.arange(np.count_nonzero(keep))
+
+    offsets = [0]
+    neighbors = []
+    for row, column in zip(*np.nonzero(keep)):
+
+        # odd rows are shifted east, so the diagonal neighbors of a row depend on whether it is odd
+        shift = row % 2
+        for r, c in ((row, column - 1), (row, column + 1),
+                     (row - 1, column - 1 + shift), (row - 1, column + shift),
+                     (row + 1, column - 1 + shift), (row + 1, column + shift)):
+            if 0 <= r < rows and 0 <= c < columns and keep[r, c]:
+                neighbors.append(index[r, c])
+        offsets.append(len(neighbors))
+
+    return np.array(offsets, dtype=np.int32), np.array(neighbors, dtype=np.int32)
+
+
+# builds a world file from a raster at a hex spacing in km
+# cells with less than land_share of their pixels on land are left out as sea
+def build_world_file(spacing, output, raster_path=None, land_share=0.5):
+    latitudes, longitudes, column_step, row_step = hex_grid(spacing)
+    if raster_path is None:
+        raster_path = pick_raster(spacing, float(np.mean(latitudes)))
+    raster = Raster(raster_path)
+
+    elevation, land = sample_elevation(raster, latitudes, longitudes, column_step, row_step)
+    inside = longitudes <= bounds[2]
+    keep = (land >= land_share) & inside
+
+    offsets, neighbors = hex_adjacency(keep)
+    x = longitudes[keep]
+    y = np.broadcast_to(latitudes[:, None], keep.shape)[keep]
+
+    # cells in the first or last row or column of the grid, the last column of a row being its last one inside the bounds
+    edge = np.zeros(keep.shape, dtype=bool)
+    edge[[0, -1], :] = True
+    edge[:, 0] = True
+    edge[:, :-1] |= ~inside[:, 1:]
+    edge[:, -1] = True
+
+    header = {"version": WORLD_FILE_VERSION, "spacing_km": spacing, "raster": raster_path, "bounds": bounds, "land_share": land_share}
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    np.savez(output, header=np.array(json.dumps(header)), x=x, y=y, elevation=elevation[keep],
+             offsets=offsets, neighbors=neighbors, coastal=find_coastal(offsets, neighbors, x, y, edge[keep]))
+    return len(x)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 4):
+        print("usage: python ingest.py <spacing in km> <output.npz> [raster.tif]")
+        sys.exit(1)
+
+    cells = build_world_file(float(sys.argv[1]), sys.argv[2], sys.argv[3] if len(sys.argv) == 4 else None)
+    print(f"{cells} cells written to {sys.argv[2]}")
@@ -11,16 +11,24 @@
 # moralizing single god vs. many gods
 # give every cell an elevation tech
 
-import geopandas as gpd
 import math
 import mesa
 import mesa_geo as mg
 import random
 from mesa import DataCollector
-from numpy import percentile
-
+from numpy import percentile, zeros
+
+from array_engine import ArrayEngine
+from battle_log import BattleLog
+from religion_kernel import ReligionKernel
+from reporter_sink import ReporterSink
+from agent_recorder import AgentRecorder
+from recording import RunRecorder
+from perf import PerfCounters, phase
+from convergence import ConvergenceCheck
 from cell import EmpireCell
 from empire import Empire
+from world import load_world
 from technology import *
 from religion import *
 
@@ -34,9 +42,24 @@ class EuropeModel(mesa.Model):
     def __init__(self, power_decline=4, sim_length=200, delta_power=0.1,
                  asa_growth=0.2, asa_decay=0.1, elevation_constant=6.5, tech_frequency=0,
                  use_elevation=True, agent_reporters=True, use_warmup=False, batch_run=True,
-                 show_heatmap=False, show_elevation=False, show_coastal=False):
+                 show_heatmap=False, show_elevation=False, show_coastal=False, array_engine=False,
+                 record_battles=False, batched_religion=False, reporter_sink=None, agent_recorder=None, seed=None, profile=False,
+                 convergence_window=None, convergence_tolerance=0.05, recording=None,
+                 map_file="gis_data/hex_with_elevation.geojson"):
+
+        # constructor arguments, kept so a checkpoint can rebuild the model
+        self.parameters = {name: value for name, value in locals().items() if name not in ("self", "__class__")}
+
+        # cells, empires and religions draw from the global random module and the scheduler from the model's own,
+        # so both are seeded to make a run repeatable
+        if seed is not None:
+            random.seed(seed)
+
         super().__init__()
 
+        if seed is not None:
+            self.random.seed(seed)
+
         # power decline is determined by the UI slider
         self.power_decline = power_decline
 
@@ -72,7 +95,13 @@ class EuropeModel(mesa.Model):
 
         self.batch_run = batch_run
 
-        self.differences = []
+        # whether the model was branched off a shared warm-up instead of starting from step 0, see warmup.py
+        self.use_warmup = use_warmup
+
+        # log of every attack, only kept when asked for as it is not needed for the usual reporters
+        # the average power difference is worked out from it
+        self.battle_log = BattleLog() if record_battles else None
+        self.battles_before_step = 0
         self.avg_difference = 0
 
         # sets schedule to be random activation so as not to favor one empire
@@ -80,8 +109,22 @@ class EuropeModel(mesa.Model):
 
         # list of empires currently in the model
         self.empires = []
+
+        # id of the next empire founded
+        # ids are never reused, so an id always means the same empire over a whole run, e.g. in recordings
+        self.next_empire_id = 1
         self.religions = []
 
+        # traits of every religion in the model, keyed by religion id
+        # cells only hold religion ids and conversion levels and look the traits up here
+        self.religion_registry = {}
+
+        # religion that every cell starts out with
+        chiefdom_religion = Religion(0)
+        chiefdom_religion.type = "non-pros"
+        chiefdom_religion.tolerance = 0.75
+        self.religion_registry[0] = chiefdom_religion
+
         self.default_religion = Religion(0)
         self.default_religion.type = "non-pros"
         self.default_religion.tolerance = 1.5
@@ -98,62 +141,142 @@ class EuropeModel(mesa.Model):
         # each element is a frequency bar
         self.area_histogram = [0 for x in range(13)]
 
+        # stops the run once average empire area and number of empires have stopped changing
+        # compares the last two windows of convergence_window steps, off unless a window is given
+        if convergence_window is not None:
+            self.convergence = ConvergenceCheck(convergence_window, convergence_tolerance)
+        else:
+            self.convergence = None
+
+        # wall time and call counts of each phase of a step and each cell method, only kept when profiling
+        self.perf = PerfCounters() if profile else None
+
         # data collector
         # format is {<datapoint name>: lambda model: model.<reporting function or variable>, ...}
         if self.agent_reporters:
-            self.datacollector = DataCollector(model_reporters={"starting x": lambda model: model.starting_x,
-                                                                "starting y": lambda model: model.starting_y,
-                                                                "steps": lambda model: model.steps,
-                                                                "Average Empire Area (Hexes)": lambda model: model.avg_empire_area,
-                                                                "Average Empire Area (m^2)": lambda model: model.avg_empire_area * self.hex_to_meters,
-                                                                "Number of Empires": lambda model: len([empire for empire in model.empires if empire.size > 5]),
-                                                                "Elevation Constant": lambda model: model.elevation_constant},
-                                               agent_reporters={"Elevation": lambda agent: agent.elevation,
-                                                                "Times Changed Hands": lambda agent: agent.times_changed_hands + 0.0001})
+            model_reporters = {"starting x": lambda model: model.starting_x,
+                               "starting y": lambda model: model.starting_y,
+                               "steps": lambda model: model.steps,
+                               "Average Empire Area (Hexes)": lambda model: model.avg_empire_area,
+                               "Average Empire Area (m^2)": lambda model: model.avg_empire_area * self.hex_to_meters,
+                               "Number of Empires": lambda model: model.number_of_empires(),
+                               "Elevation Constant": lambda model: model.elevation_constant}
+            agent_reporters = ({"Elevation": lambda agent: agent.elevation,
+                                "Times Changed Hands": lambda agent: agent.times_changed_hands + 0.0001}
+                               if agent_recorder is None else None)
+        else:
+            model_reporters = {"starting x": lambda model: model.starting_x,
+                               "starting y": lambda model: model.starting_y,
+                               "steps": lambda model: model.steps,
+                               "Average Empire Area (Hexes)": lambda model: model.avg_empire_area,
+                               "Average Empire Area (m^2)": lambda model: model.avg_empire_area * self.hex_to_meters,
+                               "Number of Empires": lambda model: model.number_of_empires(),
+                               "Average Empire Elevation": lambda model: model.avg_empire_elevation,
+                               "Average Power Difference": lambda model: model.avg_difference,
+                               "5-50 Hexes": lambda model: model.area_histogram[0],
+                               "51-100 Hexes": lambda model: model.area_histogram[1],
+                               "101-150 Hexes": lambda model: model.area_histogram[2],
+                               "151-200 Hexes": lambda model: model.area_histogram[3],
+                               "201-250 Hexes": lambda model: model.area_histogram[4],
+                               "251-300 Hexes": lambda model: model.area_histogram[5],
+                               "301-350 Hexes": lambda model: model.area_histogram[6],
+                               "351-400 Hexes": lambda model: model.area_histogram[7],
+                               "401-450 Hexes": lambda model: model.area_histogram[8],
+                               "451-500 Hexes": lambda model: model.area_histogram[9],
+                               "501-550 Hexes": lambda model: model.area_histogram[10],
+                               "551-600 Hexes": lambda model: model.area_histogram[11],
+                               "601 or more Hexes": lambda model: model.area_histogram[12],
+                               "Elevation Constant": lambda model: model.elevation_constant}
+            agent_reporters = None
+
+        # profiling totals go into the reporters so they end up in batch run output
+        # they are collected partway through a step, so they are a step behind
+        if self.perf is not None:
+            for name in self.perf.seconds:
+                model_reporters[f"perf {name} seconds"] = lambda model, name=name: model.perf.seconds[name]
+                model_reporters[f"perf {name} calls"] = lambda model, name=name: model.perf.calls[name]
+
+        self.datacollector = DataCollector(model_reporters=model_reporters, agent_reporters=agent_reporters)
+
+        # directory to stream the model reporters to each step, instead of keeping them in the data collector
+        # agent reporters are not collected when this is set
+        if reporter_sink is not None:
+            self.reporter_sink = ReporterSink(reporter_sink, self.datacollector.model_reporters)
         else:
-            self.datacollector = DataCollector(model_reporters={"starting x": lambda model: model.starting_x,
-                                                                "starting y": lambda model: model.starting_y,
-                                                                "steps": lambda model: model.steps,
-                                                                "Average Empire Area (Hexes)": lambda model: model.avg_empire_area,
-                                                                "Average Empire Area (m^2)": lambda model: model.avg_empire_area * self.hex_to_meters,
-                                                                "Number of Empires": lambda model: len([empire for empire in model.empires if empire.size > 5]),
-                                                                "Average Empire Elevation": lambda model: model.avg_empire_elevation,
-                                                                "Average Power Difference": lambda model: model.avg_difference,
-                                                                "5-50 Hexes": lambda model: model.area_histogram[0],
-                                                                "51-100 Hexes": lambda model: model.area_histogram[1],
-                                                                "101-150 Hexes": lambda model: model.area_histogram[2],
-                                                                "151-200 Hexes": lambda model: model.area_histogram[3],
-                                                                "201-250 Hexes": lambda model: model.area_histogram[4],
-                                                                "251-300 Hexes": lambda model: model.area_histogram[5],
-                                                                "301-350 Hexes": lambda model: model.area_histogram[6],
-                                                                "351-400 Hexes": lambda model: model.area_histogram[7],
-                                                                "401-450 Hexes": lambda model: model.area_histogram[8],
-                                                                "451-500 Hexes": lambda model: model.area_histogram[9],
-                                                                "501-550 Hexes": lambda model: model.area_histogram[10],
-                                                                "551-600 Hexes": lambda model: model.area_histogram[11],
-                                                                "601 or more Hexes": lambda model: model.area_histogram[12],
-                                                                "Elevation Constant": lambda model: model.elevation_constant})
+            self.reporter_sink = None
 
         # creates the geo space with the GeoJSON coordinate system
         self.space = mg.GeoSpace(crs="epsg:4326", warn_crs_conversion=False)
 
-        # agent generator
-        ac = mg.AgentCreator(EmpireCell, model=self)
+        # static map data shared by every model in this process
+        # the map file is only read the first time a model is built
+        # either the GeoJSON map or a world file at another spacing from ingest.py
+        self.world = load_world(map_file)
+        self.adjacency = self.world.adjacency
+
+        # directory to record the cells to each step as numpy blocks, instead of as agent reporters
+        if agent_recorder is not None:
+            self.agent_recorder = AgentRecorder(agent_recorder, self.world)
+        else:
+            self.agent_recorder = None
+
+        # directory to record the run to for playback, see recording.py
+        if recording is not None:
+            self.run_recorder = RunRecorder(recording, self.world)
+        else:
+            self.run_recorder = None
+
+        # elevation modifier of every directed edge, shared by every model with the same settings
+        self.edge_modifiers = self.world.elevation_modifiers(self.elevation_constant, self.use_elevation)
+
+        # updates the religions of all cells at once each step, from the state at the start of the step
+        # off by default, so religions are updated one cell at a time in the scheduler's random order as they originally were
+        self.batched_religion = batched_religion
+        self.religion_kernel = None
+
+        # step each cell last changed hands, religion or display, so the map only restyles the cells that changed
+        self.changed_at = zeros(self.world.size, dtype="int64")
+
+        # the array engine keeps the cell and empire state in numpy arrays instead of in agents
+        self.array_engine = array_engine
+        if self.array_engine:
+            self.cells = []
+            self.engine = ArrayEngine(self, self.world)
+            self.starting_x = self.engine.starting_x[0]
+            self.starting_y = self.engine.starting_y[0]
+        else:
+            self.engine = None
+            self.setup_cells()
+
+    # hands out the id of a new empire
+    def new_empire_id(self):
+        empire_id = self.next_empire_id
+        self.next_empire_id += 1
+        return empire_id
+
+    # creates the cell agents and the initial empire
+    def setup_cells(self):
 
-        # creates cells from the GeoJSON data file
-        gdf = gpd.read_file("gis_data/hex_with_elevation.geojson")
-        self.cells = ac.from_GeoDataFrame(gdf)
+        # creates cells from the shared map data
+        self.cells = [EmpireCell(unique_id, self, geometry, self.world.crs)
+                      for unique_id, geometry in zip(self.world.ids, self.world.geometries)]
 
         # adds those agents to the geo space
         self.space.add_agents(self.cells)
 
         # adds all new cells to the default empire
         # also adds them to the scheduler
-        for cell in self.cells:
-            cell.elevation *= 100
+        # neighbors are set first so the empire can file the cell on its frontier
+        for index, cell in enumerate(self.cells):
+            cell.elevation = float(self.world.elevation[index])
+            cell.elev_mod = cell.religion_elevation_modifier()
+            cell.neighbors = [self.cells[i] for i in self.adjacency.neighbors_of(index).tolist()]
+            edges = slice(self.adjacency.offsets[index], self.adjacency.offsets[index + 1])
+            cell.neighbor_modifiers = dict(zip([neighbor.id for neighbor in cell.neighbors],
+                                               self.edge_modifiers[edges].tolist()))
             self.default_empire.add_cell(cell)
             self.schedule.add(cell)
-            cell.setup_neighbors()
+            cell.coastal = bool(self.adjacency.coastal[index])
             if self.show_heatmap:
                 cell.show_heatmap = True
 
@@ -163,10 +286,6 @@ class EuropeModel(mesa.Model):
             if self.show_elevation:
                 cell.show_elevation = True
 
-        # spaghetti code to fix coastal cells
-        for cell in [cell for cell in self.cells if cell.coastal]:
-            cell.fix_coastal()
-
         # sets up the initial empire
 
         # picks a random cell
@@ -175,22 +294,33 @@ class EuropeModel(mesa.Model):
         self.starting_y = starting_cells[0].y
 
         # initializes its neighbors as part of the starting empire as well
-        # checks to make sure its neighbors are actually close to it
-        for neighbor in self.space.get_neighbors(starting_cells[0]):
-            if self.space.distance(starting_cells[0], neighbor) < 1:
-                starting_cells.append(neighbor)
+        starting_cells += starting_cells[0].neighbors
 
         # adds the first empire to the empire list
-        self.empires.append(Empire(len(self.empires) + 1, self))
+        self.empires.append(Empire(self.new_empire_id(), self))
 
         # adds each starting cell to that empire
         for cell in starting_cells:
-            cell.religions.clear()
-            self.empires[0].add_cell(cell)
+            cell.religion_ids.clear()
+            cell.conversions.clear()
             self.default_empire.remove_cell(cell)
+            self.empires[0].add_cell(cell)
             cell.update_religion()
-            cell.majReligion = cell.religions[0]
-            cell.majReligion.conversion = 1
+            cell.majReligion = cell.religion_ids[0]
+            cell.conversions[0] = 1
+
+        if self.batched_religion:
+            self.religion_kernel = ReligionKernel(self)
+
+        if self.perf is not None:
+            for cell in self.cells:
+                self.perf.wrap_cell(cell)
+
+    # counts the number of empires with size greater than 5
+    def number_of_empires(self):
+        if self.engine:
+            return self.engine.number_of_empires()
+        return len([empire for empire in self.empires if empire.size > 5])
 
     # updates the average area of all empires
     def update_avg_area(self):
@@ -212,11 +342,10 @@ class EuropeModel(mesa.Model):
 
     def tech_drop(self):
 
-        choices = []
-        for cell in self.cells:
-            if cell.empire.id != 0:
-                if len([neighbor for neighbor in cell.neighbors if neighbor.empire.id != cell.empire.id]) == 0:
-                    choices.append(cell)
+        # picks from the interior cells of every empire
+        # sorted back into cell order so the random choice is the same as when every cell was scanned
+        choices = sorted((cell for empire in self.empires for cell in empire.interior_cells.values()),
+                         key=lambda cell: cell.id)
         if len(choices) == 0:
             return
         else:
@@ -249,13 +378,35 @@ class EuropeModel(mesa.Model):
         cell_choice.add_technology(tech)
         self.techs_dropped.append(tech)
 
+    # averages the size of the power differences of the attacks made in the last step
     def update_avg_difference(self):
-        if len(self.differences) > 0:
-            total = 0
-            for diff in self.differences:
-                total += abs(diff)
-            self.avg_difference = total / len(self.differences)
-        self.differences.clear()
+        differences = self.battle_log.since(self.battles_before_step)["difference"]
+        if len(differences) > 0:
+            self.avg_difference = float(abs(differences).mean())
+        self.battles_before_step = self.battle_log.count
+
+    # records the reporters for this step, either in the data collector or in the reporter sink
+    def collect(self):
+        if self.reporter_sink is not None:
+            self.reporter_sink.append({name: reporter(self) for name, reporter in self.datacollector.model_reporters.items()})
+        else:
+            self.datacollector.collect(self)
+
+        if self.agent_recorder is not None:
+            self.agent_recorder.record(self)
+
+        if self.run_recorder is not None:
+            self.run_recorder.record(self)
+
+    # writes out anything the reporter sink and agent recorder are still holding
+    # called at the end of a run
+    def close(self):
+        if self.reporter_sink is not None:
+            self.reporter_sink.close()
+        if self.agent_recorder is not None:
+            self.agent_recorder.close()
+        if self.run_recorder is not None:
+            self.run_recorder.close()
 
     # model actions on each step
     def step(self):
@@ -265,33 +416,63 @@ class EuropeModel(mesa.Model):
             # tracks running time
             self.steps += 1
 
-            # updates empires
-            # removes them from the empire list if their size is 0 or less
-            for empire in self.empires:
-                empire.update_size()
-                if empire.size == 0:
-                    self.empires.remove(empire)
-                    continue
+            with phase(self, "empires"):
+                if self.engine:
+                    # updates the empires and data variables from the cell arrays
+                    self.engine.update_empires()
+                else:
+                    # updates empires
+                    # removes them from the empire list if their size is 0 or less
+                    for empire in self.empires:
+                        empire.update_size()
+                        if empire.size == 0:
+                            self.empires.remove(empire)
+                            continue
 
-                empire.update_properties()
+                        empire.update_properties()
 
-            # updates data variables
-            self.update_avg_area()
+                    # updates data variables
+                    self.update_avg_area()
 
             # collects data on each step
-            self.datacollector.collect(self)
-
-            # steps all cells in a random order
-            self.schedule.step()
+            with phase(self, "collect"):
+                self.collect()
+
+            if self.engine:
+                # steps all cells at once
+                with phase(self, "engine"):
+                    self.engine.step()
+            else:
+                # updates the religions of all cells, then steps all cells in a random order
+                if self.religion_kernel is not None:
+                    with phase(self, "religion"):
+                        self.religion_kernel.step()
+                with phase(self, "cells"):
+                    self.schedule.step()
+
+            if self.battle_log is not None:
+                with phase(self, "battles"):
+                    self.update_avg_difference()
+
+            # stops a batch run early once it has reached a stationary state
+            if self.convergence is not None:
+                values = {"Average Empire Area (Hexes)": self.avg_empire_area, "Number of Empires": self.number_of_empires()}
+                if self.convergence.update(self.steps, values):
+                    self.running = False
 
             # stops the simulation after the inputted number of steps have occurred
             if not self.batch_run and self.steps >= self.sim_length:
                 self.running = False
 
+                # the array engine has no cell agents to display the heatmap on
+                if self.engine:
+                    return
+
                 # determines the quartiles for the heatmap
                 percentiles = percentile([cell.times_changed_hands for cell in self.cells], [20, 60, 75, 90])
 
                 # sets the running value for the cells to be false, so they display appropriately
+                self.changed_at[:] = self.steps
                 for cell in self.cells:
                     cell.running = False
                     for perc in percentiles:
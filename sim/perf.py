@@ -0,0 +1,66 @@
+import time
+from contextlib import nullcontext
+
+# phases of a model step
+model_phases = ["empires", "collect", "religion", "cells", "engine", "battles"]
+
+# cell methods timed on every call
+cell_methods = ["update_religion", "update_ultrasociality", "update_asabiya", "update_power", "attack"]
+
+
+# wall time and call counts of each phase of a model step and of each cell method, added up over a run
+# cell methods are timed by wrapping them on each cell when profiling is on, so the cells run unchanged when it is off
+class PerfCounters:
+
+    def __init__(self):
+        self.seconds = {name: 0.0 for name in model_phases + cell_methods}
+        self.calls = {name: 0 for name in model_phases + cell_methods}
+
+    # times the block it wraps as a phase of the step
+    def phase(self, name):
+        return Timer(self, name)
+
+    def add(self, name, seconds):
+        self.seconds[name] += seconds
+        self.calls[name] += 1
+
+    # replaces a cell's methods with timed ones
+    def wrap_cell(self, cell):
+        for name in cell_methods:
+            setattr(cell, name, self.timed(name, getattr(cell, name)))
+
+    def timed(self, name, method):
+        def timed_method(*args, **kwargs):
+            start = time.perf_counter()
+            result = method(*args, **kwargs)
+            self.add(name, time.perf_counter() - start)
+            return result
+        return timed_method
+
+    # flat totals, to go into a row of batch output
+    def totals(self):
+        row = {}
+        for name in self.seconds:
+            row[f"perf {name} seconds"] = self.seconds[name]
+            row[f"perf {name} calls"] = self.calls[name]
+        return row
+
+
+class Timer:
+
+    def __init__(self, counters, name):
+        self.counters = counters
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exception):
+        self.counters.add(self.name, time.perf_counter() - self.start)
+
+
+# times a phase if the model is being profiled, and does nothing otherwise
+def phase(model, name):
+    if model.perf is None:
+        return nullcontext()
+    return model.perf.phase(name)
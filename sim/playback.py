@@ -0,0 +1,112 @@
+import sys
+from types import SimpleNamespace
+
+import mesa
+import numpy as np
+import xyzservices.providers as xyz
+from mesa.visualization.modules import TextElement
+from mesa.visualization.UserParam import Slider, NumberInput
+
+from delta_map import DeltaMapModule, DeltaMapServer
+from recording import Recording
+from server import cell_style
+
+# plays a recorded run back on the map without stepping a model
+# usage: python playback.py output_data/recordings/<run>
+#
+# the start step and speed are set in the browser, a negative speed plays the run backward,
+# and resetting with a new start step jumps straight to it
+
+# loaded recordings, keyed by path, so resetting to scrub does not read the file again
+_recordings = {}
+
+
+# stands in for an EmpireCell, with just what the map styles read
+class PlaybackCell:
+
+    def __init__(self, model, x, y):
+        self.model = model
+        self.x = x
+        self.y = y
+        self.show_elevation = False
+        self.show_coastal = False
+        self.show_heatmap = False
+        self.running = True
+        self.color = "grey"
+        self.majReligion = None
+        self.conversions = [0]
+
+
+class PlaybackModel(mesa.Model):
+
+    def __init__(self, path, start_step=0, speed=1):
+        super().__init__()
+
+        if path not in _recordings:
+            _recordings[path] = Recording(path)
+        self.recording = _recordings[path]
+
+        self.religion_registry = {religion_id: SimpleNamespace(type=religion_type)
+                                  for religion_id, religion_type in self.recording.religion_types.items()}
+        self.cells = [PlaybackCell(self, x, y) for x, y in zip(self.recording.x.tolist(), self.recording.y.tolist())]
+
+        self.speed = int(speed)
+        self.position = min(max(int(start_step), 0), self.recording.steps - 1)
+        self.running = True
+
+        # frames shown, and the frame each cell last changed in, read by the delta map like a model's
+        self.steps = 0
+        self.changed_at = np.zeros(len(self.cells), dtype=np.int64)
+        self.shown = None
+        self.show()
+
+    # puts the recorded state of the current step onto the cells that differ from the last one shown
+    def show(self):
+        owner, religion, conversion = state = self.recording.state_at(self.position)
+        if self.shown is None:
+            changed = np.arange(len(self.cells))
+        else:
+            changed = np.flatnonzero((owner != self.shown[0]) | (religion != self.shown[1]) | (conversion != self.shown[2]))
+        self.shown = state
+        self.changed_at[changed] = self.steps
+
+        colors = self.recording.empire_colors
+        for index in changed.tolist():
+            cell = self.cells[index]
+            cell.color = colors.get(int(owner[index]), "grey")
+            cell.majReligion = None if religion[index] < 0 else int(religion[index])
+            cell.conversions[0] = float(conversion[index])
+
+    # moves speed steps through the recording, stopping at either end
+    def step(self):
+        position = self.position + self.speed
+        if position < 0 or position >= self.recording.steps:
+            position = min(max(position, 0), self.recording.steps - 1)
+            self.running = False
+
+        self.position = position
+        self.steps += 1
+        self.show()
+
+
+class StepText(TextElement):
+
+    def render(self, model):
+        return f"Step: {model.position + 1} / {model.recording.steps}"
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("usage: python playback.py <recording directory>")
+        sys.exit(1)
+
+    grid = DeltaMapModule(cell_style, [46, 17], 3.75, tiles=xyz.CartoDB.Positron, map_width=900, map_height=600)
+
+    model_params = {
+        "path": sys.argv[1],
+        "start_step": NumberInput("Start at step", value=0),
+        "speed": Slider("Speed (steps per frame, negative plays backward)", value=1, min_value=-50, max_value=50, step=1)
+    }
+
+    server = DeltaMapServer(PlaybackModel, [grid, StepText()], "Europe Sim Playback", model_params)
+    server.launch()
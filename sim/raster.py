@@ -0,0 +1,221 @@
+import math
+import os
+import sys
+
+import numpy as np
+from matplotlib.colors import to_rgb
+
+# headless image export of the map layers, straight from cell arrays
+# usage: python raster.py <agents or recording directory> <output directory> [step]
+#
+# every pixel of the image is mapped to the cell whose center is nearest to it once, when the map is built,
+# so drawing a layer is just picking a color per cell and indexing it with that mapping
+
+# raster maps already built, keyed by (map file, width)
+_raster_maps = {}
+
+# colors of the layers, the same as server.py uses for the cells
+background_color = "white"
+elevation_levels = [(1500, "Red"), (1000, "Orange"), (500, "Yellow"), (-math.inf, "Green")]
+heatmap_colors = ["Green", "YellowGreen", "Yellow", "Orange", "Red"]
+
+layers = ["ownership", "religion", "elevation", "coastal", "heatmap"]
+
+
+class RasterMap:
+
+    def __init__(self, world, width=900):
+        self.world = world
+        self.width = width
+
+        # equirectangular projection, with longitude shrunk by the cosine of the middle latitude
+        x0, x1 = float(world.x.min()), float(world.x.max())
+        y0, y1 = float(world.y.min()), float(world.y.max())
+        aspect = (y1 - y0) / ((x1 - x0) * math.cos(math.radians((y0 + y1) / 2)))
+
+        # leaves room for the cells along the edges
+        margin = 8
+        scale = (width - 2 * margin) / (x1 - x0)
+        self.height = int(round((width - 2 * margin) * aspect)) + 2 * margin
+        px = margin + (world.x - x0) * scale
+        py = margin + (y1 - world.y) * (self.height - 2 * margin) / (y1 - y0)
+
+        # a pixel belongs to the nearest cell center within a bit more than a hex's circumradius,
+        # which is about 0.58 of the distance between neighboring centers, and to no cell otherwise
+        spacing = float(np.median(np.hypot(px[world.edge_source] - px[world.adjacency.neighbors],
+                                           py[world.edge_source] - py[world.adjacency.neighbors])))
+        radius = 0.6 * spacing
+        reach = int(math.ceil(radius))
+
+        # stamps every cell's neighborhood of pixels at once for each offset, keeping the nearest cell of every pixel
+        self.pixel_cell = np.full((self.height, self.width), -1, dtype=np.int32)
+        nearest = np.full((self.height, self.width), np.inf)
+        cx = np.rint(px).astype(np.intp)
+        cy = np.rint(py).astype(np.intp)
+        cells = np.arange(world.size, dtype=np.int32)
+        for dy in range(-reach, reach + 1):
+            for dx in range(-reach, reach + 1):
+                x = cx + dx
+                y = cy + dy
+                distance = np.hypot(x - px, y - py)
+                inside = (distance <= radius) & (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+                x, y, distance, cell = x[inside], y[inside], distance[inside], cells[inside]
+
+                closer = distance < nearest[y, x]
+                nearest[y[closer], x[closer]] = distance[closer]
+                self.pixel_cell[y[closer], x[closer]] = cell[closer]
+
+        self.pixel_cell.setflags(write=False)
+
+    # an image from a color per cell, as an (n, 3) array of 0-1 rgb values
+    def render(self, cell_colors):
+        colors = np.vstack([cell_colors, to_rgb(background_color)])
+        return (colors[self.pixel_cell] * 255).round().astype(np.uint8)
+
+    def save(self, path, cell_colors):
+        from matplotlib.image import imsave
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        imsave(path, self.render(cell_colors))
+
+
+# returns the raster map of a world at a width, building it the first time it is asked for
+# like load_world, building it before a sweep's pool is forked lets the workers share it
+def raster_map(world, width=900):
+    key = (world.path, width)
+    if key not in _raster_maps:
+        _raster_maps[key] = RasterMap(world, width)
+    return _raster_maps[key]
+
+
+# looks up colors by name, once per distinct name
+def named_colors(names):
+    lookup = {}
+    return np.array([lookup[name] if name in lookup else lookup.setdefault(name, to_rgb(name)) for name in names])
+
+
+# color of every cell by the empire that owns it
+# empires without a known color get one made from their id, as the array engine does not give them colors
+def ownership_colors(owner, empire_colors=None):
+    empire_colors = empire_colors or {}
+    ids, inverse = np.unique(owner, return_inverse=True)
+    palette = named_colors([empire_colors.get(empire_id, "grey" if empire_id == 0 else f"#{(empire_id * 2654435761) % 16777216:06x}")
+                            for empire_id in ids.tolist()])
+    return palette[inverse]
+
+
+# color of every cell by the type of its majority religion, faded toward the background by its conversion level
+def religion_colors(religion, conversion, religion_types):
+    color = named_colors(["Red" if religion_types.get(religion_id) == "pros" else "Green" for religion_id in religion.tolist()])
+    strength = np.where(religion >= 0, np.clip(conversion, 0, 1), 0)[:, None]
+    return strength * color + (1 - strength) * np.array(to_rgb(background_color))
+
+
+def elevation_colors(elevation):
+    colors = np.empty((len(elevation), 3))
+    assigned = np.zeros(len(elevation), dtype=bool)
+    for level, name in elevation_levels:
+        cells = ~assigned & (elevation > level)
+        colors[cells] = to_rgb(name)
+        assigned |= cells
+    return colors
+
+
+def coastal_colors(coastal):
+    return np.where(np.asarray(coastal, dtype=bool)[:, None], to_rgb("Red"), to_rgb("YellowGreen"))
+
+
+# times changed hands split at the same percentiles as the model's end of run heatmap
+# cells that never changed hands are grey
+def heatmap_colors_of(times_changed_hands):
+    percentiles = np.percentile(times_changed_hands, [20, 60, 75, 90])
+    colors = named_colors(heatmap_colors)[np.searchsorted(percentiles, times_changed_hands, side="left")]
+    colors[times_changed_hands == 0] = to_rgb("grey")
+    return colors
+
+
+# the cell arrays of a model's current state
+def model_state(model):
+    world = model.world
+    if model.engine:
+        return {"owner": model.engine.owner, "times_changed_hands": model.engine.times_changed_hands,
+                "elevation": world.elevation, "coastal": world.coastal}
+
+    cells = model.cells
+    return {"owner": np.fromiter((cell.empire.id for cell in cells), dtype=np.int64, count=len(cells)),
+            "empire_colors": {empire.id: empire.color for empire in [model.default_empire] + model.empires},
+            "religion": np.fromiter((-1 if cell.majReligion is None else cell.majReligion for cell in cells), dtype=np.int64, count=len(cells)),
+            "conversion": np.fromiter((cell.conversions[0] if cell.conversions else 0 for cell in cells), dtype=np.float64, count=len(cells)),
+            "religion_types": {religion_id: traits.type for religion_id, traits in model.religion_registry.items()},
+            "times_changed_hands": np.fromiter((cell.times_changed_hands for cell in cells), dtype=np.int64, count=len(cells)),
+            "elevation": world.elevation, "coastal": world.coastal}
+
+
+# writes a png of every layer the state has the arrays for to a directory, returning the files written
+def export_layers(raster, state, directory):
+    colors = {}
+    if "owner" in state:
+        colors["ownership"] = ownership_colors(state["owner"], state.get("empire_colors"))
+    if "religion" in state:
+        colors["religion"] = religion_colors(state["religion"], state["conversion"], state.get("religion_types", {}))
+    if "elevation" in state:
+        colors["elevation"] = elevation_colors(state["elevation"])
+    if "coastal" in state:
+        colors["coastal"] = coastal_colors(state["coastal"])
+    if "times_changed_hands" in state:
+        colors["heatmap"] = heatmap_colors_of(state["times_changed_hands"])
+
+    paths = []
+    for layer, cell_colors in colors.items():
+        path = os.path.join(directory, f"{layer}.png")
+        raster.save(path, cell_colors)
+        paths.append(path)
+    return paths
+
+
+def export_model(model, directory, width=900):
+    return export_layers(raster_map(model.world, width), model_state(model), directory)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 4):
+        print("usage: python raster.py <agents or recording directory> <output directory> [step]")
+        sys.exit(1)
+
+    import json
+
+    from world import load_world
+
+    source, output = sys.argv[1], sys.argv[2]
+    step = int(sys.argv[3]) if len(sys.argv) == 4 else -1
+
+    if not os.path.exists(os.path.join(source, "recording.json")):
+        from agent_recorder import read_agents
+
+        with open(os.path.join(source, "agents.json")) as file:
+            map_file = json.load(file).get("map_file")
+        agents = read_agents(source)
+        x, y = agents["x"], agents["y"]
+        state = {"owner": agents["owner"][step], "times_changed_hands": agents["times_changed_hands"][step],
+                 "elevation": agents["elevation"], "coastal": agents["coastal"]}
+    else:
+        from recording import Recording
+
+        recording = Recording(source)
+        map_file = recording.header.get("map_file")
+        x, y = recording.x, recording.y
+        owner, religion, conversion = recording.state_at(step if step >= 0 else recording.steps + step)
+        state = {"owner": owner, "empire_colors": recording.empire_colors, "religion": religion, "conversion": conversion,
+                 "religion_types": recording.religion_types}
+
+    # the map the run was recorded on, or the default map for sources recorded before the map file was kept
+    # the stored coordinates have to match it, so the images are drawn on the cells the run was on
+    world = load_world(map_file) if map_file else load_world()
+    if world.size != len(x) or not (np.array_equal(world.x, x) and np.array_equal(world.y, y)):
+        print(f"{source} was not recorded on {world.path}")
+        sys.exit(1)
+    state.setdefault("elevation", world.elevation)
+    state.setdefault("coastal", world.coastal)
+
+    for path in export_layers(raster_map(world), state, output):
+        print(path)
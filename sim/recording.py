@@ -0,0 +1,195 @@
+import json
+import os
+
+import numpy as np
+
+# conversion levels are stored as hundredths in a byte, which is finer than the map shows them
+conversion_scale = 100
+
+# columns of the recording and the type each is stored as
+keyframe_columns = {"owner": np.int32, "religion": np.int32, "conversion": np.uint8}
+delta_columns = {"cell": np.int32, "owner": np.int32, "religion": np.int32, "conversion": np.uint8}
+
+
+# records a run for playback, the owner, majority religion and conversion level of every cell each step
+#
+# every keyframe_interval steps the whole state is stored as a keyframe,
+# and every other step only stores the cells that changed since the step before it,
+# so most of a run is a few hundred border cells a step instead of every cell
+#
+# written to a directory like AgentRecorder's, the coordinates once as .npy files and every other column as a raw file
+# that the buffered steps are appended to every steps_per_block steps, so a run is never held in memory,
+# and a json header that is rewritten with every block, so a run that stops early can still be played back
+class RunRecorder:
+
+    def __init__(self, directory, world, keyframe_interval=50, steps_per_block=50):
+        self.directory = directory
+        self.world = world
+        self.keyframe_interval = keyframe_interval
+        self.steps_per_block = steps_per_block
+        self.steps = 0
+
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "x.npy"), world.x)
+        np.save(os.path.join(directory, "y.npy"), world.y)
+
+        # buffered steps, written out a block at a time
+        self.keyframe_steps = []
+        self.keyframes = {name: [] for name in keyframe_columns}
+
+        # changed cells of every step, step i being [delta_offsets[i], delta_offsets[i + 1])
+        self.delta_count = 0
+        self.delta_offsets = [0]
+        self.deltas = {name: [] for name in delta_columns}
+        self.buffered = 0
+
+        # colors of the empires and types of the religions seen so far, for drawing the map
+        self.empire_colors = {}
+        self.religion_types = {}
+
+        self.last = None
+
+        # starts every column file empty, in case the directory held an earlier run
+        for name in ["keyframe_steps", "delta_offsets"] + [f"keyframe_{name}" for name in keyframe_columns] + \
+                [f"delta_{name}" for name in delta_columns]:
+            open(self.column_path(name), "wb").close()
+
+    def column_path(self, name):
+        return os.path.join(self.directory, f"{name}.bin")
+
+    # the state of every cell as arrays
+    def state(self, model):
+        if model.engine:
+            # the array engine has no religions or empire colors
+            owner = model.engine.owner.astype(np.int32)
+            religion = np.full(len(owner), -1, dtype=np.int32)
+            conversion = np.zeros(len(owner), dtype=np.uint8)
+            for empire_id in np.unique(owner).tolist():
+                if empire_id not in self.empire_colors:
+                    self.empire_colors[empire_id] = "grey" if empire_id == 0 else f"#{(empire_id * 2654435761) % 16777216:06x}"
+            return owner, religion, conversion
+
+        cells = model.cells
+        owner = np.fromiter((cell.empire.id for cell in cells), dtype=np.int32, count=len(cells))
+        religion = np.fromiter((-1 if cell.majReligion is None else cell.majReligion for cell in cells), dtype=np.int32, count=len(cells))
+        conversion = np.fromiter((min(round(cell.conversions[0] * conversion_scale), 255) if cell.conversions else 0 for cell in cells),
+                                 dtype=np.uint8, count=len(cells))
+
+        for empire in [model.default_empire] + model.empires:
+            self.empire_colors.setdefault(empire.id, empire.color)
+        for religion_id, traits in model.religion_registry.items():
+            self.religion_types.setdefault(religion_id, traits.type)
+        return owner, religion, conversion
+
+    # records the current state of every cell
+    def record(self, model):
+        state = dict(zip(keyframe_columns, self.state(model)))
+
+        if self.steps % self.keyframe_interval == 0:
+            self.keyframe_steps.append(self.steps)
+            for name, values in state.items():
+                self.keyframes[name].append(values)
+
+        # the first step has nothing to change from, its keyframe is the whole state
+        if self.last is None:
+            changed = np.zeros(0, dtype=np.int64)
+        else:
+            changed = np.flatnonzero((state["owner"] != self.last["owner"]) | (state["religion"] != self.last["religion"]) |
+                                     (state["conversion"] != self.last["conversion"]))
+        self.deltas["cell"].append(changed.astype(np.int32))
+        for name, values in state.items():
+            self.deltas[name].append(values[changed])
+        self.delta_count += len(changed)
+        self.delta_offsets.append(self.delta_count)
+
+        self.last = state
+        self.steps += 1
+        self.buffered += 1
+        if self.buffered == self.steps_per_block:
+            self.flush()
+
+    # appends the buffered steps to the column files and rewrites the header
+    def flush(self):
+        if self.buffered == 0:
+            return
+
+        self.append("keyframe_steps", np.array(self.keyframe_steps, dtype=np.int64))
+        self.append("delta_offsets", np.array(self.delta_offsets, dtype=np.int64))
+        for name, dtype in keyframe_columns.items():
+            if self.keyframes[name]:
+                self.append(f"keyframe_{name}", np.stack(self.keyframes[name]).astype(dtype))
+        for name, dtype in delta_columns.items():
+            self.append(f"delta_{name}", np.concatenate(self.deltas[name]).astype(dtype))
+
+        self.keyframe_steps = []
+        self.keyframes = {name: [] for name in keyframe_columns}
+        self.delta_offsets = []
+        self.deltas = {name: [] for name in delta_columns}
+        self.buffered = 0
+
+        header = {"steps": self.steps, "cells": self.world.size, "map_file": self.world.path,
+                  "keyframe_interval": self.keyframe_interval,
+                  "conversion_scale": conversion_scale,
+                  "columns": {**{f"keyframe_{name}": np.dtype(dtype).str for name, dtype in keyframe_columns.items()},
+                              **{f"delta_{name}": np.dtype(dtype).str for name, dtype in delta_columns.items()}},
+                  "empire_colors": {str(empire_id): color for empire_id, color in self.empire_colors.items()},
+                  "religion_types": {str(religion_id): religion_type for religion_id, religion_type in self.religion_types.items()}}
+        with open(os.path.join(self.directory, "recording.json"), "w") as file:
+            json.dump(header, file)
+
+    def append(self, name, values):
+        with open(self.column_path(name), "ab") as file:
+            file.write(values.tobytes())
+
+    def close(self):
+        self.flush()
+
+
+# a recorded run, read back for playback
+# the columns are memory mapped, so a long run is not loaded into memory to play it back
+class Recording:
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "recording.json")) as file:
+            self.header = json.load(file)
+
+        cells = self.header["cells"]
+        self.arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r") for name in ("x", "y")}
+        columns = {"keyframe_steps": "<i8", "delta_offsets": "<i8", **self.header["columns"]}
+        for name, dtype in columns.items():
+            path = os.path.join(directory, f"{name}.bin")
+            if os.path.getsize(path) > 0:
+                self.arrays[name] = np.memmap(path, dtype=np.dtype(dtype), mode="r")
+            else:
+                self.arrays[name] = np.zeros(0, dtype=np.dtype(dtype))
+        for name in keyframe_columns:
+            self.arrays[f"keyframe_{name}"] = self.arrays[f"keyframe_{name}"].reshape(-1, cells)
+
+        self.steps = self.header["steps"]
+        self.x = self.arrays["x"]
+        self.y = self.arrays["y"]
+        self.empire_colors = {int(empire_id): color for empire_id, color in self.header["empire_colors"].items()}
+        self.religion_types = {int(religion_id): religion_type for religion_id, religion_type in self.header["religion_types"].items()}
+
+    # owner, majority religion (-1 for none) and conversion level of every cell at a step
+    # starts from the keyframe at or before the step and applies the changes after it,
+    # so any step can be reached in either direction without going through the rest of the run
+    def state_at(self, step):
+        step = min(max(step, 0), self.steps - 1)
+        keyframe = np.searchsorted(self.arrays["keyframe_steps"], step, side="right") - 1
+        owner = self.arrays["keyframe_owner"][keyframe].copy()
+        religion = self.arrays["keyframe_religion"][keyframe].copy()
+        conversion = self.arrays["keyframe_conversion"][keyframe].copy()
+
+        offsets = self.arrays["delta_offsets"]
+        changes = slice(offsets[self.arrays["keyframe_steps"][keyframe] + 1], offsets[step + 1])
+        cells = self.arrays["delta_cell"][changes]
+
+        # only the last change to each cell counts
+        _, last = np.unique(cells[::-1], return_index=True)
+        latest = changes.start + len(cells) - 1 - last
+        cells = self.arrays["delta_cell"][latest]
+        owner[cells] = self.arrays["delta_owner"][latest]
+        religion[cells] = self.arrays["delta_religion"][latest]
+        conversion[cells] = self.arrays["delta_conversion"][latest]
+        return owner, religion, conversion / self.header["conversion_scale"]
@@ -0,0 +1,121 @@
+import random
+from itertools import chain
+
+import numpy as np
+
+
+# batched version of EmpireCell.update_religion
+# updates the religions of every cell at once from the state at the start of the step,
+# instead of one cell at a time in the scheduler's random order
+#
+# the religions of all cells are flattened into (cell, religion, conversion) pairs,
+# with each cell's pairs contiguous and its majority religion first
+class ReligionKernel:
+
+    def __init__(self, model):
+
+        self.model = model
+        self.cells = model.cells
+
+        # separate generator for the conversion draws, seeded from the global one so seeded runs repeat
+        self.rng = np.random.default_rng(random.getrandbits(64))
+
+        # directed edges of the map, lined up with the adjacency
+        self.source = model.world.edge_source
+        self.target = model.adjacency.neighbors
+
+        # elevation damping never changes, so it is gathered from the cells once
+        self.elev_mod = np.array([cell.elev_mod for cell in self.cells])
+
+        # religion traits indexed by religion id
+        # grown as new religions are added to the registry
+        self.conv_chance = np.zeros(0)
+        self.tolerance = np.zeros(0)
+        self.non_pros = np.zeros(0, dtype=bool)
+
+    # copies the traits of religions that were registered since the last step
+    # religion ids are handed out in order, so new religions are always at the end
+    def update_traits(self):
+
+        registry = self.model.religion_registry
+        known = len(self.conv_chance)
+        size = max(registry) + 1
+        if size == known:
+            return
+
+        new = [registry[religion_id] for religion_id in range(known, size)]
+        self.conv_chance = np.concatenate((self.conv_chance, [religion.conv_chance for religion in new]))
+        self.tolerance = np.concatenate((self.tolerance, [religion.tolerance for religion in new]))
+        self.non_pros = np.concatenate((self.non_pros, [religion.type == "non-pros" for religion in new]))
+
+    # counts, for every (cell, religion) pair, the neighbors of the cell that have that religion as their majority
+    def neighbor_majority_counts(self, majority, pair_cell, religion_ids):
+
+        religion_count = len(self.conv_chance)
+        neighbor_majority = majority[self.target]
+        counted = neighbor_majority > 0
+
+        keys, key_counts = np.unique(self.source[counted] * religion_count + neighbor_majority[counted], return_counts=True)
+        if len(keys) == 0:
+            return np.zeros(len(pair_cell))
+
+        pair_keys = pair_cell * religion_count + religion_ids
+        found = np.minimum(np.searchsorted(keys, pair_keys), len(keys) - 1)
+        return np.where(keys[found] == pair_keys, key_counts[found], 0)
+
+    # updates the religions of every cell
+    def step(self):
+
+        self.update_traits()
+        cells = self.cells
+        n = len(cells)
+
+        # flattens the religions of every cell
+        counts = np.array([len(cell.religion_ids) for cell in cells])
+        religion_ids = np.fromiter(chain.from_iterable(cell.religion_ids for cell in cells), dtype=np.int64)
+        conversions = np.fromiter(chain.from_iterable(cell.conversions for cell in cells), dtype=np.float64)
+        majority = np.array([-1 if cell.majReligion is None else cell.majReligion for cell in cells])
+        empire_religion = np.array([cell.empire.religion.id for cell in cells])
+
+        pair_cell = np.repeat(np.arange(n), counts)
+        first = (np.cumsum(counts) - counts)[pair_cell]
+        cell_majority = majority[pair_cell]
+        has_majority = cell_majority >= 0
+        majority_traits = np.maximum(cell_majority, 0)
+
+        # same chance as in EmpireCell.update_religion
+        chance = self.conv_chance[religion_ids] * conversions + 0.025 * self.neighbor_majority_counts(majority, pair_cell, religion_ids)
+        tolerance_mod = np.where(has_majority & (religion_ids != cell_majority), self.tolerance[majority_traits], 1)
+        pros_mod = np.where(has_majority & self.non_pros[majority_traits], (1 - conversions[first]) / 2, 1)
+        converts = (religion_ids != 0) & (self.rng.random(len(religion_ids)) < chance * tolerance_mod * pros_mod * self.elev_mod[pair_cell])
+
+        # each conversion raises its religion and takes an equal share away from each of the cell's other religions
+        increase = np.where(religion_ids == empire_religion[pair_cell], 0.1, 0.025) * converts
+        others = counts[pair_cell] - 1
+        decrease = np.where(others > 0, np.round(increase / np.maximum(others, 1), 3), 0)
+        cell_decrease = np.bincount(pair_cell, weights=decrease, minlength=n)
+        conversions = conversions + increase - (cell_decrease[pair_cell] - decrease)
+        self.model.changed_at[pair_cell[converts]] = self.model.steps
+
+        # drops religions that have lost all their converts and caps the rest at full conversion
+        kept = conversions >= 0
+        pair_cell = pair_cell[kept]
+        religion_ids = religion_ids[kept]
+        conversions = np.minimum(conversions[kept], 1)
+
+        # sorts each cell's religions from most to least converted, keeping the order of ties
+        order = np.lexsort((-conversions, pair_cell))
+        ends = np.cumsum(np.bincount(pair_cell, minlength=n)).tolist()
+        religion_ids = religion_ids[order].tolist()
+        conversions = conversions[order].tolist()
+
+        # writes the religions back to the cells
+        start = 0
+        for cell, end in zip(cells, ends):
+            cell.religion_ids = religion_ids[start:end]
+            cell.conversions = conversions[start:end]
+            if end > start and cell.conversions[0] >= 0.5:
+                cell.majReligion = cell.religion_ids[0]
+            else:
+                cell.majReligion = None
+            start = end
@@ -0,0 +1,109 @@
+import json
+import os
+
+import numpy as np
+
+
+# writes a run's per step model reporters to disk column by column, instead of keeping them in memory
+# each run gets its own directory (partition) holding one raw float64 file per reporter,
+# plus columns.json naming the reporter stored in each file
+# rows are buffered and appended to the files in batches
+#
+# resume_rows carries on a run restored from a checkpoint in the partition it was writing to,
+# keeping its first resume_rows rows and dropping any written after the checkpoint
+class ReporterSink:
+
+    def __init__(self, directory, columns, batch_size=100, resume_rows=None):
+        self.directory = directory
+        self.columns = list(columns)
+        self.batch_size = batch_size
+
+        # reporter names can have any characters in them, so the files are numbered instead
+        self.files = [f"column_{index}.f64" for index in range(len(self.columns))]
+
+        self.buffer = []
+        self.rows = 0
+
+        # the most recent row, so the end of run values can be read without going back to disk
+        self.last_row = None
+
+        if resume_rows is not None:
+            self.resume(resume_rows)
+            return
+
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "columns.json"), "w") as file:
+            json.dump(dict(zip(self.columns, self.files)), file)
+
+        # starts every column file empty, in case the directory held an earlier run
+        for name in self.files:
+            open(os.path.join(directory, name), "wb").close()
+
+    # cuts the partition back to its first rows and picks up its last row from them
+    def resume(self, rows):
+        with open(os.path.join(self.directory, "columns.json")) as file:
+            if json.load(file) != dict(zip(self.columns, self.files)):
+                raise ValueError(f"{self.directory} was written with other reporters")
+
+        for name in self.files:
+            path = os.path.join(self.directory, name)
+            if os.path.getsize(path) < rows * 8:
+                raise ValueError(f"{self.directory} has fewer than the {rows} rows to resume from")
+            os.truncate(path, rows * 8)
+
+        self.rows = rows
+        if rows > 0:
+            data = read_partition(self.directory, self.columns)
+            self.last_row = {column: float(data[column][-1]) for column in self.columns}
+
+    # adds a row of reporter values, keyed by reporter name
+    def append(self, row):
+        self.buffer.append([row[column] for column in self.columns])
+        self.last_row = row
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    # writes the buffered rows to the end of the column files
+    def flush(self):
+        if not self.buffer:
+            return
+
+        block = np.array(self.buffer, dtype=np.float64)
+        for index, name in enumerate(self.files):
+            with open(os.path.join(self.directory, name), "ab") as file:
+                file.write(block[:, index].tobytes())
+
+        self.rows += len(self.buffer)
+        self.buffer.clear()
+
+    def close(self):
+        self.flush()
+
+
+# reads some or all of the reporter columns of a partition
+# columns are memory mapped, so only the parts that are used are read from disk
+def read_partition(directory, columns=None):
+    with open(os.path.join(directory, "columns.json")) as file:
+        files = json.load(file)
+
+    data = {}
+    for column in (columns if columns is not None else files):
+        path = os.path.join(directory, files[column])
+        if os.path.getsize(path) > 0:
+            data[column] = np.memmap(path, dtype=np.float64, mode="r")
+        else:
+            data[column] = np.zeros(0)
+    return data
+
+
+# reads some or all of the reporter columns of many partitions into one dataframe
+# with a "partition" column saying which run each row came from
+def read_partitions(directories, columns=None):
+    import pandas
+
+    frames = []
+    for directory in directories:
+        frame = pandas.DataFrame(read_partition(directory, columns))
+        frame["partition"] = directory
+        frames.append(frame)
+    return pandas.concat(frames, ignore_index=True)
@@ -6,6 +6,8 @@ from matplotlib import pyplot as plot
 import math
 
 from model import EuropeModel
+from ensemble import EnsembleEngine
+from world import load_world
 
 hex_to_meters = 863000000
 
@@ -22,6 +24,10 @@ default_columns = ['Average Empire Area (Hexes)', 'Average Empire Area (m^2)', '
 
 if __name__ == '__main__':
 
+    # loads the static map data once in the parent process
+    # the batch run workers are forked from here, so they share it instead of each parsing the GeoJSON again
+    world = load_world()
+
     prompt_text = ("1. Model Modification Test\n"
                    "2. Power Decline Tests\n"
                    "3. Starting Position Tests\n"
@@ -33,7 +39,11 @@ if __name__ == '__main__':
                    "9. Elevation Constant Tests\n"
                    "10. Logged Area Distribution Tests\n"
                    "11. Elev Constant / Power Decline Combo Tests\n"
-                   "12. Elevation Technology Tests\n")
+                   "12. Elevation Technology Tests\n"
+                   "13. Average Power Difference Tests\n"
+                   "14. Technology Frequency Tests\n"
+                   "15. Array Engine Comparison Tests\n"
+                   "16. Ensemble Starting Position Tests\n")
     test = input(prompt_text)
 
     match test:
@@ -111,6 +121,12 @@ if __name__ == '__main__':
 
         case "9":
             parameters = {"elevation_constant": [x / 2 for x in range(0, 20)], "agent_reporters": False}
+
+            # builds the elevation modifier tables before the workers are forked so they all share them
+            # the model uses 10 - elevation_constant internally
+            for constant in parameters["elevation_constant"]:
+                world.elevation_modifiers(10 - constant, True)
+
             data = mesa.batch_run(model_cls=EuropeModel, parameters=parameters, number_processes=13, max_steps=400, iterations=5)
 
             columns = ['elevation_constant']
@@ -137,6 +153,9 @@ if __name__ == '__main__':
         case "11":
             # parameters = {"power_decline": [2, 4], "elevation_constant": [2, 4, 6, 8]}
             parameters = {"power_decline": [x for x in range(1, 9)], "elevation_constant": [y for y in range(0, 10)], "agent_reporters": False}
+            for constant in parameters["elevation_constant"]:
+                world.elevation_modifiers(10 - constant, True)
+
             data = mesa.batch_run(model_cls=EuropeModel, parameters=parameters, number_processes=13, max_steps=400, iterations=1)
 
             columns = ['elevation_constant', 'power_decline']
@@ -150,7 +169,7 @@ if __name__ == '__main__':
             delta_powers = []
             steps = [y for y in range(1, 601)]
             ticks = 600
-            model = EuropeModel(sim_length=ticks, agent_reporters=False)
+            model = EuropeModel(sim_length=ticks, agent_reporters=False, record_battles=True)
             for x in range(ticks):
                 model.step()
                 delta_powers.append(model.avg_difference)
@@ -170,3 +189,28 @@ if __name__ == '__main__':
 
             graph = sns.pairplot(data=dataframe, x_vars="tech_frequency", y_vars=['Average Empire Area (Hexes)', 'Number of Empires', 'Average Empire Elevation'], height=5, aspect=1)
             plot.show()
+
+        case "15":
+            # runs the object and array engines over the same parameters to check that they give the same distributions
+            parameters = {"array_engine": [False, True], "power_decline": [1, 2, 4, 8], "agent_reporters": False}
+            data = mesa.batch_run(model_cls=EuropeModel, parameters=parameters, number_processes=13, max_steps=400, iterations=10)
+
+            columns = ['array_engine', 'power_decline']
+            dataframe = pandas.DataFrame(data=data, columns=(columns + default_columns))
+            dataframe.to_csv(path_or_buf="output_data/engine_comparison.csv", index_label="trial")
+
+            engines = sns.pairplot(data=dataframe, x_vars=["power_decline"], y_vars=["Average Empire Area (Hexes)", "Number of Empires"], height=5, aspect=1, hue="array_engine")
+            plot.show()
+
+        case "16":
+            # same as case 3 on the array engine, with all 200 iterations stepped together as one ensemble
+            ensemble = EnsembleEngine(200, power_decline=4.5)
+            for x in range(400):
+                ensemble.step()
+
+            columns = ['starting x', 'starting y']
+            dataframe = pandas.DataFrame(data=ensemble.results(), columns=(columns + default_columns))
+            dataframe.to_csv(path_or_buf="output_data/starting_point_ensemble.csv", index_label="trial")
+
+            sns.pairplot(data=dataframe, x_vars=['starting x', 'starting y'], y_vars=['Average Empire Area (Hexes)'], height=5, aspect=1)
+            plot.show()
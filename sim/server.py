@@ -1,141 +1,81 @@
 
-import mesa_geo.visualization
 import xyzservices.providers as xyz
-from mesa.visualization.ModularVisualization import ModularServer
-from model import EuropeModel
+from background import BackgroundEuropeModel, BackgroundServer
+from delta_map import DeltaMapModule
 from mesa.visualization.modules import BarChartModule, ChartModule, TextElement
 from mesa.visualization.UserParam import Slider, Checkbox, NumberInput
 from technology import *
 
 
-# defines how agents are portrayed on the map
-def agent_portrayal(agent):
+# defines how cells are drawn on the map
+# returns the (color, fill color, fill opacity) of a cell, the delta map only sends the cells whose style changed
+# cells without a fill of their own are filled with their color at leaflet's default opacity
+def cell_style(agent):
 
     # see cell elevation
     if agent.show_elevation:
         if agent.elevation > 1500:
-            portrayal = {"shape": "circle",
-                         "color": "Red",
-                         "radius": 2,
-                         "weight": 1,
-                         "description": (round(agent.x, 2), round(agent.y, 2))
-                         }
+            color = "Red"
         elif agent.elevation > 1000:
-            portrayal = {"shape": "circle",
-                         "color": "Orange",
-                         "radius": 2,
-                         "weight": 1,
-                         "description": (round(agent.x, 2), round(agent.y, 2))
-                         }
+            color = "Orange"
         elif agent.elevation > 500:
-            portrayal = {"shape": "circle",
-                         "color": "Yellow",
-                         "radius": 2,
-                         "weight": 1,
-                         "description": (round(agent.x, 2), round(agent.y, 2))
-                         }
+            color = "Yellow"
         else:
-            portrayal = {"shape": "circle",
-                         "color": "Green",
-                         "radius": 2,
-                         "weight": 1,
-                         "description": (round(agent.x, 2), round(agent.y, 2))
-                         }
+            color = "Green"
+        return color, color, 0.2
 
     # see coastal cells
     elif agent.show_coastal:
         if agent.coastal:
-            portrayal = {"shape": "circle",
-                         "color": "Red",
-                         "radius": 2,
-                         "weight": 1,
-                         "description": (round(agent.x, 2), round(agent.y, 2))
-                         }
+            color = "Red"
         else:
-            portrayal = {"shape": "circle",
-                         "color": "YellowGreen",
-                         "radius": 2,
-                         "weight": 1,
-                         "description": (round(agent.x, 2), round(agent.y, 2))
-                         }
+            color = "YellowGreen"
+        return color, color, 0.2
 
     # normal cell display
     elif agent.running or not agent.show_heatmap:
 
-        portrayal = {"shape": "circle",
-                     "color": agent.color,
-                     "radius": 2,
-                     "weight": 1,
-                     "description": (round(agent.x, 2), round(agent.y, 2)),
-                     "fillOpacity": 0
-                     }
-
-        if agent.majReligion:
-            if agent.majReligion.type == "pros":
-                portrayal["fillColor"] = "Red"
+        if agent.majReligion is not None:
+            # the majority religion is always the first, most converted, religion of the cell
+            conversion = agent.conversions[0]
+
+            if agent.model.religion_registry[agent.majReligion].type == "pros":
+                fill_color = "Red"
             else:
-                portrayal["fillColor"] = "Green"
-
-            if agent.majReligion.conversion > 1:
-                portrayal["fillOpacity"] = 1
-            elif agent.majReligion.conversion > 0.8:
-                portrayal["fillOpacity"] = 0.8
-            elif agent.majReligion.conversion > 0.6:
-                portrayal["fillOpacity"] = 0.6
-            elif agent.majReligion.conversion > 0.4:
-                portrayal["fillOpacity"] = 0.4
-            elif agent.majReligion.conversion > 0.2:
-                portrayal["fillOpacity"] = 0.2
+                fill_color = "Green"
+
+            if conversion > 1:
+                fill_opacity = 1
+            elif conversion > 0.8:
+                fill_opacity = 0.8
+            elif conversion > 0.6:
+                fill_opacity = 0.6
+            elif conversion > 0.4:
+                fill_opacity = 0.4
+            elif conversion > 0.2:
+                fill_opacity = 0.2
             else:
-                portrayal["fillOpacity"] = 0
+                fill_opacity = 0
         else:
-            portrayal["fillColor"] = "Red"
+            fill_color = "Red"
+            fill_opacity = 0
+
+        return agent.color, fill_color, fill_opacity
 
     else:
         if agent.times_changed_hands == 0:
-            portrayal = {"shape": "circle",
-                         "color": "grey",
-                         "radius": 2,
-                         "weight": 1,
-                         "description": (round(agent.x, 2), round(agent.y, 2))
-                         }
+            color = "grey"
         elif agent.times_changed_hands > agent.percentiles[3]:
-            portrayal = {"shape": "circle",
-                         "color": "Red",
-                         "radius": 2,
-                         "weight": 1,
-                         "description": (round(agent.x, 2), round(agent.y, 2))
-                         }
+            color = "Red"
         elif agent.times_changed_hands > agent.percentiles[2]:
-            portrayal = {"shape": "circle",
-                         "color": "Orange",
-                         "radius": 2,
-                         "weight": 1,
-                         "description": (round(agent.x, 2), round(agent.y, 2))
-                         }
+            color = "Orange"
         elif agent.times_changed_hands > agent.percentiles[1]:
-            portrayal = {"shape": "circle",
-                         "color": "Yellow",
-                         "radius": 2,
-                         "weight": 1,
-                         "description": (round(agent.x, 2), round(agent.y, 2))
-                         }
+            color = "Yellow"
         elif agent.times_changed_hands > agent.percentiles[0]:
-            portrayal = {"shape": "circle",
-                         "color": "YellowGreen",
-                         "radius": 2,
-                         "weight": 1,
-                         "description": (round(agent.x, 2), round(agent.y, 2))
-                         }
+            color = "YellowGreen"
         else:
-            portrayal = {"shape": "circle",
-                         "color": "Green",
-                         "radius": 2,
-                         "weight": 1,
-                         "description": (round(agent.x, 2), round(agent.y, 2))
-                         }
-
-    return portrayal
+            color = "Green"
+        return color, color, 0.2
 
 
 # text displays
@@ -168,9 +108,9 @@ area_histogram = BarChartModule([{"Label": "5-50 Hexes", "Color": "#cc2121"},
                                  {"Label": "550-600 Hexes", "Color": "#ab0782"},
                                  {"Label": "601 or more Hexes", "Color": "#db84c5"}])
 
-# creates the grid from the map module
+# creates the grid from the delta map module, which sends the cell positions once and then only the cells that changed
 # can change dimensions of the canvas here if needed
-grid = mesa_geo.visualization.MapModule(agent_portrayal, [46, 17], 3.75, tiles=xyz.CartoDB.Positron, map_width=900, map_height=600)
+grid = DeltaMapModule(cell_style, [46, 17], 3.75, tiles=xyz.CartoDB.Positron, map_width=900, map_height=600)
 
 # slider for inputting power decline
 power_decline_slider = Slider('Power Decline', value=4, min_value=0.1, max_value=8, step=0.1)
@@ -191,6 +131,16 @@ show_coastal = Checkbox("Show coastal cells?", value=False)
 
 use_elevation = Checkbox("Elevation Modifier?", value=True)
 
+# the model runs on its own thread once started, these control it while it runs
+# speed is in steps per second, and fast-forward runs that many steps straight through,
+# e.g. the simulation length to skip to the heatmap
+paused = Checkbox("Paused?", value=False)
+speed = Slider("Speed (steps per second, 0 for as fast as possible)", value=10, min_value=0, max_value=100, step=1)
+fast_forward = NumberInput("Fast-forward (Steps)", value=0)
+
+# records the run to output_data/recordings, to be watched again with playback.py
+record = Checkbox("Record run?", value=False)
+
 # dictionary of model parameters to be passed into the server
 # can modify with user settable parameters like sliders
 model_params = {
@@ -204,11 +154,17 @@ model_params = {
     "delta_power": delta_power_slider,
     "asa_growth": asa_growth_slider,
     "asa_decay": asa_decay_slider,
+    "paused": paused,
+    "speed": speed,
+    "fast_forward": fast_forward,
+    "record": record,
     "agent_reporters": False,
     "batch_run": False
 }
 
 # creates and launches the server
-server = ModularServer(EuropeModel, [grid, NumEmpiresText(),  num_empires_graph, AvgAreaText(), avg_area_graph, area_histogram], "Europe Sim", model_params)
-server.launch()
+# only when run directly, so playback.py can use the map styles without starting a model
+if __name__ == '__main__':
+    server = BackgroundServer(BackgroundEuropeModel, [grid, NumEmpiresText(),  num_empires_graph, AvgAreaText(), avg_area_graph, area_histogram], "Europe Sim", model_params)
+    server.launch()
 
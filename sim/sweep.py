@@ -0,0 +1,231 @@
+import csv
+import itertools
+import multiprocessing
+import os
+import sys
+import time
+import tomllib
+
+from world import load_world
+
+# runs a parameter sweep described by a config file, without the run.py menu or any plot windows
+# usage: python sweep.py sweeps/power_decline.toml
+#
+# config format:
+#   output = "output_data/power_decline.csv"   where the results are written
+#   max_steps = 400                            steps per run, unless the model stops itself first,
+#                                              e.g. when convergence_window is set in [parameters]
+#   iterations = 1                             runs per parameter point
+#   processes = 8                              optional, defaults to the number of available cores
+#   columns = [...]                            optional, reporters to keep, defaults to all of them
+#   partitions = "output_data/power_decline"   optional, directory to stream every run's per step reporters to,
+#                                              one partition per run, read back with reporter_sink.read_partitions
+#   agents = "output_data/power_decline_agents" optional, directory to record every run's cells to each step,
+#                                              one directory per run, read back with agent_recorder.read_agents
+#   recordings = "output_data/power_decline_recordings" optional, directory to record every run to for playback,
+#                                              one file per run, watched with python playback.py <file>
+#   maps = "output_data/power_decline_maps"    optional, directory to draw every run's end of run map layers to,
+#                                              one directory of pngs per run, see raster.py
+#
+#   warmup_steps = 100                         optional, runs the first steps once and branches every run off them,
+#                                              the warm-up uses the single valued parameters and [warmup_parameters]
+#
+#   [parameters]                               EuropeModel constructor arguments
+#   power_decline = {start = 0.1, stop = 8.0, step = 0.1}   inclusive range
+#   use_elevation = [true, false]                           list of values
+#   agent_reporters = false                                 single value
+#
+#   [warmup_parameters]                        optional, EuropeModel constructor arguments for the warm-up
+#
+#   [adaptive]                                 optional, samples the parameter space adaptively instead of
+#                                              running every combination, see adaptive.py
+
+
+# turns a parameter's config value into the list of values to sweep over
+def parameter_values(value):
+    if isinstance(value, list):
+        return value
+
+    if isinstance(value, dict):
+        start, stop, step = value["start"], value["stop"], value.get("step", 1)
+        count = int(round((stop - start) / step)) + 1
+
+        # rounds away the floating point error of adding the step up
+        return [round(start + i * step, 10) for i in range(count)]
+
+    return [value]
+
+
+# every combination of parameter values, each repeated for every iteration
+def expand_runs(config):
+    parameters = config["parameters"]
+    names = list(parameters)
+    points = itertools.product(*[parameter_values(parameters[name]) for name in names])
+
+    runs = []
+    for point in points:
+        for iteration in range(config.get("iterations", 1)):
+            runs.append({"RunId": len(runs), "iteration": iteration, "parameters": dict(zip(names, point))})
+    return runs
+
+
+# splits the runs into chunks of about the same number of runs, in run order
+# how long a run takes depends on its parameters and on when it converges, which is not known beforehand,
+# so there are several chunks per process and processes that get quicker runs pick up more of them
+def make_chunks(runs, processes):
+    count = min(len(runs), processes * 4)
+    return [runs[len(runs) * i // count:len(runs) * (i + 1) // count] for i in range(count)]
+
+
+# runs a single model and returns a row of its parameters and final reporter values
+# if partitions is set, the per step reporters are streamed to a partition for the run,
+# and if agents is set, the cells are recorded to a directory for the run
+# the row then holds their paths
+# if warmup is set, the model is branched off those warm-up checkpoint bytes instead of starting from step 0
+def run_model(run, max_steps, partitions=None, agents=None, warmup=None, recordings=None, maps=None):
+    from model import EuropeModel
+    from warmup import branch
+
+    row = {"RunId": run["RunId"], "iteration": run["iteration"]}
+    parameters = dict(run["parameters"])
+    if partitions is not None:
+        row["partition"] = parameters["reporter_sink"] = os.path.join(partitions, f"run_{run['RunId']}")
+    if agents is not None:
+        row["agents"] = parameters["agent_recorder"] = os.path.join(agents, f"run_{run['RunId']}")
+    if recordings is not None:
+        row["recording"] = parameters["recording"] = os.path.join(recordings, f"run_{run['RunId']}")
+
+    if warmup is not None:
+        model = branch(warmup, **parameters)
+    else:
+        model = EuropeModel(**parameters)
+    while model.running and model.steps < max_steps:
+        model.step()
+
+    model.close()
+
+    if maps is not None:
+        from raster import export_model
+
+        row["maps"] = os.path.join(maps, f"run_{run['RunId']}")
+        export_model(model, row["maps"])
+
+    row["Step"] = model.steps
+    row.update(run["parameters"])
+    if model.reporter_sink is not None:
+        row.update(model.reporter_sink.last_row or {})
+    else:
+        for name, values in model.datacollector.model_vars.items():
+            if values:
+                row[name] = values[-1]
+
+    # the profiling reporters are a step behind, so the totals are taken from the model at the end
+    if model.perf is not None:
+        row.update(model.perf.totals())
+    if model.convergence is not None:
+        row.update(model.convergence.totals())
+    return row
+
+
+# worker entry point, runs every run in a chunk
+def run_chunk(args):
+    chunk, max_steps, partitions, agents, warmup, recordings, maps = args
+    return [run_model(run, max_steps, partitions, agents, warmup, recordings, maps) for run in chunk]
+
+
+# number of cores this process is allowed to use
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# loads the shared data every run needs before the pool is forked, and returns the warm-up checkpoint if there is one
+def prepare(config):
+
+    # loads the static map data and elevation modifier tables before the pool is forked so the workers share them
+    # the model uses 10 - elevation_constant internally
+    parameters = config["parameters"]
+    for map_file in parameter_values(parameters.get("map_file", "gis_data/hex_with_elevation.geojson")):
+        world = load_world(map_file)
+        for constant in parameter_values(parameters.get("elevation_constant", 6.5)):
+            for use_elevation in parameter_values(parameters.get("use_elevation", True)):
+                world.elevation_modifiers(10 - constant, use_elevation)
+
+        # and the pixel to cell mapping of the exported maps
+        if "maps" in config:
+            from raster import raster_map
+            raster_map(world)
+
+    # runs the shared warm-up once, with the parameters every point has in common
+    warmup = None
+    if "warmup_steps" in config:
+        from warmup import run_warmup
+
+        warmup_parameters = {name: value for name, value in parameters.items() if len(parameter_values(value)) == 1}
+        warmup_parameters.update(config.get("warmup_parameters", {}))
+        warmup = run_warmup(config["warmup_steps"], **warmup_parameters)
+    return warmup
+
+
+# columns of the output file, the parameters first and then the reporters, in the order of the first row
+def output_columns(config, row):
+    fieldnames = ["RunId", "iteration", "Step"] + list(config["parameters"])
+    if "partitions" in config:
+        fieldnames.append("partition")
+    if "agents" in config:
+        fieldnames.append("agents")
+    if "recordings" in config:
+        fieldnames.append("recording")
+    if "maps" in config:
+        fieldnames.append("maps")
+    return fieldnames + config.get("columns", [name for name in row if name not in fieldnames])
+
+
+def run_sweep(config):
+    max_steps = config.get("max_steps", 400)
+    runs = expand_runs(config)
+    if not runs:
+        print("the sweep has no runs")
+        return
+
+    processes = min(config.get("processes", available_cores()), len(runs))
+    chunks = make_chunks(runs, processes)
+    warmup = prepare(config)
+
+    output = config["output"]
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+
+    start = time.time()
+    finished = 0
+    with open(output, "w", newline="") as file, multiprocessing.Pool(processes) as pool:
+        writer = None
+
+        # writes results as chunks finish instead of holding them all until the end
+        tasks = [(chunk, max_steps, config.get("partitions"), config.get("agents"), warmup, config.get("recordings"),
+                  config.get("maps")) for chunk in chunks]
+        for rows in pool.imap_unordered(run_chunk, tasks):
+            if writer is None:
+                writer = csv.DictWriter(file, fieldnames=output_columns(config, rows[0]), extrasaction="ignore")
+                writer.writeheader()
+
+            writer.writerows(rows)
+            file.flush()
+
+            finished += len(rows)
+            print(f"{finished}/{len(runs)} runs finished ({time.time() - start:.0f}s)", flush=True)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        print("usage: python sweep.py <config.toml>")
+        sys.exit(1)
+
+    with open(sys.argv[1], "rb") as config_file:
+        config = tomllib.load(config_file)
+
+    if "adaptive" in config:
+        from adaptive import run_adaptive_sweep
+        run_adaptive_sweep(config)
+    else:
+        run_sweep(config)
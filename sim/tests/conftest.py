@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the sim modules import each other by name and read gis_data relative to the working directory,
+# so the tests run from the sim directory the same way run.py and sweep.py do
+sim_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, sim_directory)
+os.chdir(sim_directory)
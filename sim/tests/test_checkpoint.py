@@ -0,0 +1,109 @@
+import json
+
+import numpy as np
+import pytest
+
+from checkpoint import load_checkpoint, save_checkpoint
+from model import EuropeModel
+
+max_steps = 400
+parameters = {"agent_reporters": False, "seed": 3, "convergence_window": 20, "convergence_tolerance": 0.2}
+
+
+def run_to_end(model):
+    while model.running and model.steps < max_steps:
+        model.step()
+    return model
+
+
+# a run restored from a checkpoint partway through has to carry on exactly as the uninterrupted run does,
+# including filling the same convergence windows and stopping at the same step
+@pytest.mark.parametrize("array_engine", [False, True])
+def test_restored_run_matches_uninterrupted_run(tmp_path, array_engine):
+    uninterrupted = run_to_end(EuropeModel(array_engine=array_engine, **parameters))
+
+    model = EuropeModel(array_engine=array_engine, **parameters)
+    for step in range(30):
+        model.step()
+    path = tmp_path / "checkpoint.npz"
+    save_checkpoint(model, path)
+    restored = run_to_end(load_checkpoint(path))
+
+    assert restored.steps == uninterrupted.steps
+    assert restored.convergence.stop_step == uninterrupted.convergence.stop_step
+    assert restored.convergence.statistics == uninterrupted.convergence.statistics
+    assert restored.datacollector.model_vars == uninterrupted.datacollector.model_vars
+
+
+# the agent reporters collected before the checkpoint are carried over, so the restored run's agent table is the whole run's
+@pytest.mark.parametrize("array_engine", [False, True])
+def test_restored_run_keeps_agent_records(tmp_path, array_engine):
+    uninterrupted = EuropeModel(array_engine=array_engine, agent_reporters=True, seed=3)
+    for step in range(40):
+        uninterrupted.step()
+
+    model = EuropeModel(array_engine=array_engine, agent_reporters=True, seed=3)
+    for step in range(20):
+        model.step()
+    path = tmp_path / "checkpoint.npz"
+    save_checkpoint(model, path)
+    restored = load_checkpoint(path)
+    for step in range(20):
+        restored.step()
+
+    assert restored.datacollector._agent_records == uninterrupted.datacollector._agent_records
+    assert restored.datacollector.model_vars == uninterrupted.datacollector.model_vars
+
+
+# a run restored into the partition and cell directory it was writing to drops the steps written after the checkpoint
+# and carries on from it, ending up with the same files as a run that was never stopped
+def test_restored_run_resumes_its_outputs(tmp_path):
+    outputs = {"agent_reporters": False, "seed": 3}
+
+    def output_paths(name):
+        return {"reporter_sink": str(tmp_path / name / "partition"), "agent_recorder": str(tmp_path / name / "agents")}
+
+    uninterrupted = EuropeModel(**outputs, **output_paths("uninterrupted"))
+    for step in range(40):
+        uninterrupted.step()
+    uninterrupted.close()
+
+    model = EuropeModel(**outputs, **output_paths("restored"))
+    for step in range(20):
+        model.step()
+    path = tmp_path / "checkpoint.npz"
+    save_checkpoint(model, path)
+
+    # the interrupted run gets further than the checkpoint before it stops
+    for step in range(10):
+        model.step()
+    model.close()
+
+    restored = load_checkpoint(path, **output_paths("restored"))
+    for step in range(20):
+        restored.step()
+    restored.close()
+
+    assert restored.reporter_sink.last_row == uninterrupted.reporter_sink.last_row
+    for name in ("partition", "agents"):
+        expected = tmp_path / "uninterrupted" / name
+        for file in expected.iterdir():
+            if file.suffix in (".f64", ".bin"):
+                assert file.read_bytes() == (tmp_path / "restored" / name / file.name).read_bytes(), file.name
+
+
+# a checkpoint's cell arrays only fit the map it was saved on
+def test_restoring_on_another_map_is_rejected(tmp_path):
+    model = EuropeModel(**parameters)
+    model.step()
+    path = tmp_path / "checkpoint.npz"
+    save_checkpoint(model, path)
+
+    with np.load(path, allow_pickle=False) as data:
+        header = json.loads(str(data["header"]))
+        arrays = {name: data[name] for name in data.files if name != "header"}
+    header["world"]["size"] += 1
+    np.savez_compressed(path, header=np.array(json.dumps(header)), **arrays)
+
+    with pytest.raises(ValueError):
+        load_checkpoint(path)
@@ -0,0 +1,51 @@
+import io
+import json
+import random
+
+import numpy as np
+
+from checkpoint import load_checkpoint, save_checkpoint
+from model import EuropeModel
+
+# constructor arguments that change how a model is built, so a branch has to use the same ones as its warm-up
+structural_parameters = ["array_engine", "batched_religion", "record_battles", "agent_reporters", "map_file"]
+
+
+# shared warm-up for parameter sweeps
+# the chaotic early steps are run once with shared parameters, the state is kept in memory as a checkpoint,
+# and every sweep point branches off a copy of it with its own parameters instead of starting from step 0
+
+
+# runs a model with the given parameters for a number of steps and returns its state as checkpoint bytes
+def run_warmup(steps, **parameters):
+    model = EuropeModel(**parameters)
+    for step in range(steps):
+        model.step()
+
+    buffer = io.BytesIO()
+    save_checkpoint(model, buffer)
+    return buffer.getvalue()
+
+
+# builds a model from a warm-up with its own parameters, ready to carry on stepping
+# every branch would otherwise draw the same random numbers as the others,
+# so the random number generators are reseeded, from the seed if one is given
+def branch(warmup, seed=None, **parameters):
+
+    with np.load(io.BytesIO(warmup), allow_pickle=False) as data:
+        warmup_parameters = json.loads(str(data["header"]))["parameters"]
+    for name in structural_parameters:
+        if name in parameters and parameters[name] != warmup_parameters[name]:
+            raise ValueError(f"{name} has to be the same as in the warm-up ({warmup_parameters[name]}), got {parameters[name]}")
+
+    # use_warmup marks the model as branched from a warm-up in its parameters and outputs
+    model = load_checkpoint(io.BytesIO(warmup), **{**parameters, "use_warmup": True})
+
+    random.seed(seed)
+    model.random.seed(seed)
+    if model.engine:
+        model.engine.rng = np.random.default_rng(random.getrandbits(64))
+    if model.religion_kernel is not None:
+        model.religion_kernel.rng = np.random.default_rng(random.getrandbits(64))
+
+    return model
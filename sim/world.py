@@ -0,0 +1,122 @@
+import json
+
+import numpy as np
+
+from adjacency import Adjacency, load_adjacency
+
+
+# calculates the elevation modifier for every directed edge (cell -> neighbor) at once
+# this is the modifier EmpireCell.elevation_modifier looks up when the cell attacks the neighbor
+def edge_elevation_modifiers(elevation, source, target, elevation_constant, use_elevation):
+
+    modifiers = np.ones(len(source))
+    if not use_elevation:
+        return modifiers
+
+    difference = elevation[source] - elevation[target]
+    with np.errstate(divide="ignore"):
+        log_difference = np.log(np.abs(difference))
+
+    # easier to win if the attacked cell is at a lower elevation
+    downhill = difference > 0
+    modifiers[downhill] = (elevation_constant - log_difference[downhill]) / elevation_constant
+    modifiers[downhill & (modifiers <= 0)] = 0.01
+
+    # harder to win if the attacked cell is at a higher elevation
+    uphill = difference < 0
+    modifiers[uphill] = (elevation_constant + log_difference[uphill]) / elevation_constant
+
+    return modifiers
+
+
+# loaded worlds, keyed by map file
+# filled in by load_world, so a process only ever parses each map once
+_worlds = {}
+
+
+# read-only static map data shared by every model built on the same map
+# holds the cell geometries, coordinates, elevation, adjacency and coastal mask
+# the map is either a GeoJSON file of hex points, or a world file built from the rasters by ingest.py
+class World:
+
+    crs = "epsg:4326"
+
+    def __init__(self, path):
+        self.path = path
+
+        if path.endswith(".npz"):
+            self.load_world_file(path)
+        else:
+            self.load_geojson(path)
+        self.size = len(self.ids)
+
+        # source cell of every directed edge, lined up with adjacency.neighbors
+        self.edge_source = np.repeat(np.arange(self.size), self.adjacency.degrees())
+
+        # elevation modifier tables, keyed by (elevation constant, use elevation)
+        # filled in by elevation_modifiers
+        self.modifier_tables = {}
+
+        # nothing should write to the template, as every model in the process shares it
+        for array in (self.x, self.y, self.elevation, self.adjacency.offsets, self.adjacency.neighbors, self.coastal,
+                      self.edge_source):
+            array.setflags(write=False)
+
+    def load_geojson(self, path):
+        import geopandas as gpd
+
+        # converts to the geo space's coordinate system once here,
+        # instead of once per agent every time a model is built
+        gdf = gpd.read_file(path).to_crs(self.crs)
+
+        self.ids = gdf.index.tolist()
+        self.geometries = list(gdf.geometry)
+        self.x = np.array([point.x for point in self.geometries])
+        self.y = np.array([point.y for point in self.geometries])
+
+        # elevation is stored in the file in hundreds of meters
+        self.elevation = gdf["elevation"].to_numpy(dtype=np.float64) * 100
+
+        self.adjacency = load_adjacency(path)
+        self.coastal = self.adjacency.coastal
+
+    # world files already hold the adjacency and coastal mask, and their elevation is in meters
+    def load_world_file(self, path):
+        from shapely.geometry import Point
+
+        from ingest import WORLD_FILE_VERSION
+
+        with np.load(path) as data:
+            version = json.loads(str(data["header"])).get("version")
+            if version != WORLD_FILE_VERSION:
+                raise ValueError(f"{path} is a version {version} world file, this version reads version {WORLD_FILE_VERSION}, "
+                                 f"build it again with ingest.py")
+            self.x = data["x"]
+            self.y = data["y"]
+            self.elevation = data["elevation"].astype(np.float64)
+            self.adjacency = Adjacency(data["offsets"], data["neighbors"], data["coastal"])
+
+        self.ids = list(range(len(self.x)))
+        self.geometries = [Point(x, y) for x, y in zip(self.x.tolist(), self.y.tolist())]
+        self.coastal = self.adjacency.coastal
+
+    # returns the elevation modifier of every directed edge for a run's settings, building it the first time
+    # building the tables for a sweep's settings in the parent process before a batch run
+    # lets the forked workers share them as well
+    def elevation_modifiers(self, elevation_constant, use_elevation):
+        key = (elevation_constant, use_elevation)
+        if key not in self.modifier_tables:
+            modifiers = edge_elevation_modifiers(self.elevation, self.edge_source, self.adjacency.neighbors,
+                                                 elevation_constant, use_elevation)
+            modifiers.setflags(write=False)
+            self.modifier_tables[key] = modifiers
+        return self.modifier_tables[key]
+
+
+# returns the world for a map file, loading it the first time it is asked for
+# calling this in the parent process before a batch run starts lets the forked
+# workers share the already loaded template copy-on-write instead of parsing the map again
+def load_world(path="gis_data/hex_with_elevation.geojson"):
+    if path not in _worlds:
+        _worlds[path] = World(path)
+    return _worlds[path]